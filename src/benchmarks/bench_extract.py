@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from typing import Dict, List
+
+from src.benchmarks.stub_server import FIXTURES_DIR
+from src.text_extractor import TextExtractor
+
+# Measures documents per second and peak memory per document for each TextExtractor handler, on the saved HTML
+# documents in src/tests/fixtures. Peak memory is what tracemalloc sees, i.e., Python objects; the memory lxml
+# allocates for the tree itself is not included. Run from the root of the repository:
+#
+#   $ python -m src.benchmarks.bench_extract --repeat 200
+
+# The url each fixture was saved from decides which handler extracts it.
+FIXTURE_URLS = {
+    "generic": "https://www.example.com/news/how-large-systems-behave",
+    "arxiv": "https://arxiv.org/abs/1807.08518",
+    "medium": "https://towardsdatascience.com/rl-train-the-robotic-arm-to-reach-a-ball-part-01-1cecd2e1cfb8",
+    "quanta": "https://www.quantamagazine.org/puzzle-with-infinite-regress-is-it-turtles-all-the-way-down-20200206/",
+    "instagram": "https://www.instagram.com/p/BfWL3G_BFTM/",
+    "twitter": "https://twitter.com/janedoe/status/1",
+}
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.html"), encoding="utf-8") as input_file:
+        return input_file.read()
+
+
+def measure(name: str, repeat: int) -> Dict[str, object]:
+    html = load_fixture(name)
+    url = FIXTURE_URLS[name]
+    TextExtractor.extract_text(html, url)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        TextExtractor.extract_text(html, url)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    TextExtractor.extract_text(html, url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"fixture": name,
+            "handler": TextExtractor.handler_for(url).__name__,
+            "html_bytes": len(html.encode("utf-8")),
+            "docs_per_second": round(repeat / elapsed, 1),
+            "peak_memory_kb": round(peak / 1024, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the TextExtractor handlers on saved HTML documents.")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of times each document is extracted.")
+    parser.add_argument("--fixtures", nargs="+", default=list(FIXTURE_URLS))
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results: List[Dict[str, object]] = [measure(name, args.repeat) for name in args.fixtures]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'fixture':>10} {'handler':>30} {'bytes':>8} {'docs/sec':>10} {'peak KB':>9}")
+        for r in results:
+            print(f"{r['fixture']:>10} {r['handler']:>30} {r['html_bytes']:>8} {r['docs_per_second']:>10} "
+                  f"{r['peak_memory_kb']:>9}")
@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from src.benchmarks.stub_server import StubServer
+from src.fetcher import AsyncFetcher
+
+# Measures how the throughput of AsyncFetcher scales with the number of requests in flight.
+# Run from the root of the repository:
+#
+#   $ python -m src.benchmarks.bench_fetch --urls 2000 --latency 0.05
+
+
+async def fetch_all(base_url: str, num_urls: int, concurrency: int) -> float:
+    fetcher = AsyncFetcher(limit=concurrency, limit_per_host=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(i: int) -> None:
+        async with semaphore:
+            response = await fetcher.get(f"{base_url}/page/{i}")
+            assert response.ok
+
+    start_time = time.perf_counter()
+    try:
+        await asyncio.gather(*(fetch(i) for i in range(num_urls)))
+    finally:
+        await fetcher.close()
+    return time.perf_counter() - start_time
+
+
+def run(num_urls: int, latency: float, concurrency_levels: List[int]) -> List[Dict[str, float]]:
+    results = []
+    with StubServer(latency=latency) as server:
+        for concurrency in concurrency_levels:
+            elapsed = asyncio.get_event_loop().run_until_complete(fetch_all(server.base_url, num_urls, concurrency))
+            results.append({"concurrency": concurrency,
+                            "urls": num_urls,
+                            "seconds": round(elapsed, 3),
+                            "urls_per_second": round(num_urls / elapsed, 1)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark AsyncFetcher against a local stub HTTP server.")
+    parser.add_argument("--urls", type=int, default=2000, help="Number of URLs to fetch per concurrency level.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Server-side delay per response, in seconds.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128, 256])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.urls, args.latency, args.concurrency)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'concurrency':>12} {'seconds':>10} {'urls/sec':>10}")
+        for r in results:
+            print(f"{r['concurrency']:>12} {r['seconds']:>10} {r['urls_per_second']:>10}")
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+from urllib.parse import urlsplit
+
+from src.benchmarks.bench_extract import FIXTURE_URLS, load_fixture
+from src.benchmarks.bench_store import get_collection
+from src.benchmarks.stub_server import LocalResolver, StubServer
+from src.fetcher import AsyncFetcher
+from src.ingest import host_of
+from src.main import execute_tasks, extract_async_text
+from src.parse_pool import ParsePool
+from src.retry import CircuitBreaker, Retrier, RetryPolicy
+from src.scheduler import BoundedScheduler
+from src.store import DocumentStore
+
+# Runs the whole text extraction path, i.e., execute_tasks over extract_async_text, offline: the urls are answered
+# by a StubServer in a process of its own, and the documents are written to mongomock, or to a local mongod when
+# --uri is given. The urls cycle through the saved documents in src/tests/fixtures, and keep the hostnames they
+# were saved from, so each is parsed by its own handler. The generic document is spread over --hosts hostnames.
+#
+# Reports, per level of concurrency, urls per second end to end, the p50 and p99 latency of a url, the CPU time
+# per document of this process and its parse workers, and the peak RSS. The stub server is not measured. Write
+# the results with --output, and diff the files of two versions:
+#
+#   $ python -m src.benchmarks.bench_pipeline --urls 2000 --latency 0.05 --output before.json
+#   $ python -m src.benchmarks.bench_pipeline --urls 2000 --latency 0.05 --error-rate 0.05 --retries 2
+
+STUB_CORPUS = "stub"
+
+
+def serve(connection, server_options: Dict[str, object]) -> None:
+    """ Runs a StubServer until anything is received on the connection. Started as a process by run(). """
+    with StubServer(**server_options) as server:
+        connection.send(server.port)
+        connection.recv()
+
+
+def make_urls(num_urls: int, port: int, corpus: List[str], num_hosts: int) -> List[str]:
+    urls = []
+    for i in range(num_urls):
+        name = corpus[i % len(corpus)]
+        if name == STUB_CORPUS:
+            urls.append(f"http://site{i % num_hosts}.example.com:{port}/page/{i}")
+        elif name == "generic":
+            urls.append(f"http://site{i % num_hosts}.example.com:{port}/fixture/generic/{i}")
+        else:
+            urls.append(f"http://{urlsplit(FIXTURE_URLS[name]).hostname}:{port}/fixture/{name}/{i}")
+    return urls
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def cpu_seconds() -> float:
+    # Parse workers are counted once they have exited, i.e., after ParsePool.shutdown(), so their start up is
+    # counted too.
+    return sum(usage.ru_utime + usage.ru_stime
+               for usage in (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {"peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+            "peak_rss_parse_worker_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1)}
+
+
+class TimedRetrier(Retrier):
+    """ A Retrier that passes the coroutine of each retry through `wrap`, e.g., to time it. """
+
+    def __init__(self, *args, wrap: Callable[[Awaitable], Awaitable]):
+        super().__init__(*args)
+        self.wrap = wrap
+
+    def retry(self, key: Hashable, attempt: int, make_coro: Callable[[], Awaitable],
+              retry_after: Optional[float] = None) -> Optional[float]:
+        return super().retry(key, attempt, lambda: self.wrap(make_coro()), retry_after)
+
+
+async def extract_all(urls: List[str], store: DocumentStore, concurrency: int, per_host: int, parser: ParsePool,
+                      retries: int) -> List[float]:
+    """
+    Extracts the urls, and returns the seconds from the start of the first attempt at a url to the end of its last
+    attempt, including the backoff between retries.
+    """
+    fetcher = AsyncFetcher(limit=concurrency, limit_per_host=per_host, resolver=LocalResolver())
+    scheduler = BoundedScheduler(concurrency, per_key_limit=per_host)
+    starts: Dict[int, float] = {}
+    ends: Dict[int, float] = {}
+    # The url an attempt is for. A retry is made while its previous attempt runs, so it is timed for the same url.
+    current_url = contextvars.ContextVar("current_url")
+
+    async def timed(i: int, coro: Awaitable[str]) -> str:
+        current_url.set(i)
+        starts.setdefault(i, time.perf_counter())
+        try:
+            return await coro
+        finally:
+            ends[i] = time.perf_counter()
+
+    # Short delays and pauses, so that retries are exercised without the run waiting for them.
+    retrier = TimedRetrier(scheduler, RetryPolicy(retries, base_delay=0.01, max_delay=0.1), CircuitBreaker(5, 0.1, 1.0),
+                           wrap=lambda coro: timed(current_url.get(), coro))
+    tasks = ((host_of(url), timed(i, extract_async_text(f"{i:032x}", url, store, fetcher, parser, retrier=retrier)))
+             for i, url in enumerate(urls))
+    try:
+        await execute_tasks(tasks, scheduler, print_every=len(urls) + 1)
+        await store.close()
+    finally:
+        await fetcher.close()
+    return [ends[i] - starts[i] for i in starts]
+
+
+async def warm_up(parser: ParsePool) -> None:
+    """ Starts the parse workers, so that the latencies measured do not include their start up. """
+    html = load_fixture("generic")
+    await asyncio.gather(*(parser.extract_text(html, FIXTURE_URLS["generic"]) for _ in range(parser.max_pending)))
+
+
+def measure(urls: List[str], uri: str, concurrency: int, per_host: int, parse_workers: Optional[int],
+            retries: int) -> Dict[str, object]:
+    collection = get_collection(uri)
+    store = DocumentStore(collection)
+    # Forked workers are children of this process, so that their CPU time is counted by RUSAGE_CHILDREN; those of
+    # the default fork server are not.
+    parser = ParsePool(max_workers=parse_workers, mp_context=multiprocessing.get_context("fork"))
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(warm_up(parser))
+        cpu_before = cpu_seconds()
+        start = time.perf_counter()
+        latencies = sorted(loop.run_until_complete(extract_all(urls, store, concurrency, per_host, parser, retries)))
+        elapsed = time.perf_counter() - start
+    finally:
+        loop.close()
+    parser.shutdown()
+    cpu = cpu_seconds() - cpu_before
+    num_ok = collection.count_documents({"extraction_status_ok": True})
+    num_docs = collection.count_documents({})
+    collection.drop()
+    return dict({"concurrency": concurrency,
+                 "urls": len(urls),
+                 "extracted": num_ok,
+                 "failed": num_docs - num_ok,
+                 "seconds": round(elapsed, 3),
+                 "urls_per_second": round(len(urls) / elapsed, 1),
+                 "p50_ms": round(1000 * percentile(latencies, 0.5), 2),
+                 "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+                 "cpu_ms_per_doc": round(1000 * cpu / len(urls), 3)},
+                **peak_rss_mb())
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict[str, object]:
+    server_options = {"latency": args.latency, "error_rate": args.error_rate, "page_size": args.page_size}
+    connection, server_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(server_connection, server_options), daemon=True)
+    server.start()
+    try:
+        port = connection.recv()
+        urls = make_urls(args.urls, port, args.corpus, args.hosts)
+        results = [measure(urls, args.uri, concurrency, args.per_host or concurrency, args.parse_workers,
+                           args.retries)
+                   for concurrency in args.concurrency]
+    finally:
+        connection.send(None)
+        server.join()
+    return {"benchmark": "pipeline",
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.utcnow().isoformat(),
+            "parameters": {name: value for name, value in vars(args).items() if name not in ("json", "output")},
+            "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the text extraction pipeline against a local stub "
+                                                 "HTTP server.")
+    parser.add_argument("--urls", type=int, default=2000, help="Number of URLs to extract per concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--per-host", type=int, default=None,
+                        help="Maximum number of requests in flight per host. Defaults to the concurrency.")
+    parser.add_argument("--hosts", type=int, default=50, help="Number of hostnames the generic pages are spread over.")
+    parser.add_argument("--corpus", nargs="+", default=sorted(FIXTURE_URLS),
+                        choices=sorted(FIXTURE_URLS) + [STUB_CORPUS],
+                        help=f"Fixtures to cycle through. '{STUB_CORPUS}' is the stub page of --page-size bytes.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Server-side delay per response, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of URLs answered with status 503.")
+    parser.add_argument("--page-size", type=int, default=None, help="Size of the stub page, in bytes.")
+    parser.add_argument("--retries", type=int, default=0, help="Retries of URLs answered with status 503.")
+    parser.add_argument("--parse-workers", type=int, default=None, help="Defaults to the number of CPUs.")
+    parser.add_argument("--uri", default="", help="MongoDb uri. Uses mongomock when left out.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--output", default=None, metavar="FILE", help="Also write the results as JSON to FILE.")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'concurrency':>12} {'urls/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'cpu ms/doc':>11} "
+              f"{'rss MB':>8} {'failed':>7}")
+        for r in report["results"]:
+            print(f"{r['concurrency']:>12} {r['urls_per_second']:>10} {r['p50_ms']:>9} {r['p99_ms']:>9} "
+                  f"{r['cpu_ms_per_doc']:>11} {r['peak_rss_mb']:>8} {r['failed']:>7}")
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from src.scheduler import BoundedScheduler
+from src.third_party import asyncioplus
+
+# Measures the overhead the scheduler adds per task, by running no-op coroutines through it.
+# Run from the root of the repository:
+#
+#   $ python -m src.benchmarks.bench_scheduler --tasks 10000 100000 1000000
+#
+# The original asyncioplus.limited_as_completed is included for comparison with --legacy. It polls and scans
+# every in-flight future for each completion, so only run it with the smaller task counts.
+
+
+async def noop() -> None:
+    pass
+
+
+async def run_scheduler(num_tasks: int, limit: int, num_keys: int) -> None:
+    scheduler = BoundedScheduler(limit, per_key_limit=limit if num_keys else None)
+    if num_keys:
+        jobs = ((i % num_keys, noop()) for i in range(num_tasks))
+    else:
+        jobs = (noop() for _ in range(num_tasks))
+    async for task in scheduler.as_completed(jobs):
+        await task
+
+
+async def run_legacy(num_tasks: int, limit: int, num_keys: int) -> None:
+    for result in asyncioplus.limited_as_completed((noop() for _ in range(num_tasks)), limit):
+        await result
+
+
+def measure(runner, num_tasks: int, limit: int, num_keys: int) -> Dict[str, float]:
+    loop = asyncio.new_event_loop()
+    try:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        loop.run_until_complete(runner(num_tasks, limit, num_keys))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    finally:
+        loop.close()
+    return {"tasks": num_tasks,
+            "seconds": round(elapsed, 3),
+            "usec_per_task": round(elapsed / num_tasks * 1e6, 2),
+            "cpu_usec_per_task": round(cpu / num_tasks * 1e6, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-task overhead of the task scheduler.")
+    parser.add_argument("--tasks", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=300, help="Maximum number of tasks in flight.")
+    parser.add_argument("--keys", type=int, default=0, help="Spread the tasks over this many per-key limits.")
+    parser.add_argument("--legacy", action="store_true", help="Also run asyncioplus.limited_as_completed.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results: List[Dict[str, object]] = []
+    for num_tasks in args.tasks:
+        results.append(dict(scheduler="BoundedScheduler", **measure(run_scheduler, num_tasks, args.limit, args.keys)))
+        if args.legacy:
+            results.append(dict(scheduler="limited_as_completed",
+                                **measure(run_legacy, num_tasks, args.limit, args.keys)))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scheduler':>22} {'tasks':>9} {'seconds':>9} {'usec/task':>10} {'cpu usec/task':>14}")
+        for r in results:
+            print(f"{r['scheduler']:>22} {r['tasks']:>9} {r['seconds']:>9} {r['usec_per_task']:>10} "
+                  f"{r['cpu_usec_per_task']:>14}")
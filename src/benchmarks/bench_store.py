@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Dict
+
+from pymongo.collection import Collection
+
+from src.store import DocumentStore
+
+# Compares per-document round-trips (find_one + insert_one for every url) with DocumentStore's batched lookups
+# and buffered bulk writes. Runs against a local mongod when --uri is given, and otherwise against mongomock:
+#
+#   $ python -m src.benchmarks.bench_store --docs 100000
+#   $ python -m src.benchmarks.bench_store --docs 100000 --uri mongodb://localhost:27017/
+
+
+def get_collection(uri: str) -> Collection:
+    if uri:
+        import pymongo
+        collection = pymongo.MongoClient(uri)["bench_store"]["documents"]
+    else:
+        import mongomock
+        collection = mongomock.MongoClient()["bench_store"]["documents"]
+    collection.drop()
+    return collection
+
+
+def make_document(i: int) -> Dict[str, object]:
+    return {"_id": f"{i:032x}",
+            "url": f"http://example.com/{i}",
+            "title": "title",
+            "text": "text " * 100,
+            "text_extracted_at": datetime.utcnow(),
+            "extraction_status_ok": True}
+
+
+def run_per_document(collection: Collection, num_docs: int) -> None:
+    for i in range(num_docs):
+        document = make_document(i)
+        if collection.find_one({"_id": document["_id"]}) is None:
+            collection.insert_one(document)
+
+
+def run_batched(collection: Collection, num_docs: int, batch_size: int) -> None:
+    store = DocumentStore(collection, batch_size=batch_size, lookup_batch_size=batch_size)
+
+    async def write_all() -> None:
+        for i in range(num_docs):
+            if f"{i:032x}" not in existing_ids:
+                await store.insert(make_document(i))
+        await store.close()
+
+    ids = [f"{i:032x}" for i in range(num_docs)]
+    existing_ids = store.find_existing_ids(ids)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(write_all())
+    finally:
+        loop.close()
+
+
+def measure(name: str, runner, collection: Collection, *args) -> Dict[str, object]:
+    collection.drop()
+    start = time.perf_counter()
+    runner(collection, *args)
+    elapsed = time.perf_counter() - start
+    num_docs = args[0]
+    assert collection.count_documents({}) == num_docs
+    return {"mode": name, "docs": num_docs, "seconds": round(elapsed, 3), "docs_per_second": round(num_docs / elapsed)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched against per-document MongoDb access.")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--uri", default="", help="MongoDb uri. Uses mongomock when left out.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    collection = get_collection(args.uri)
+    results = [measure("per-document", run_per_document, collection, args.docs),
+               measure("batched", run_batched, collection, args.docs, args.batch_size)]
+    collection.drop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'mode':>14} {'docs':>9} {'seconds':>9} {'docs/sec':>10}")
+        for r in results:
+            print(f"{r['mode']:>14} {r['docs']:>9} {r['seconds']:>9} {r['docs_per_second']:>10}")
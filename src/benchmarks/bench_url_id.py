@@ -0,0 +1,78 @@
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from src.url_id import SeenSet, compute_id, url_digest
+
+# Measures how fast url ids are computed, and how many bytes per url the set of seen ids takes, comparing a
+# Python set of hex ids with the SeenSet of binary digests. Run from the root of the repository:
+#
+#   $ python -m src.benchmarks.bench_url_id --urls 1000000
+
+
+def make_urls(num_urls: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [f"https://www.host{rng.randrange(10000)}.com/articles/{i}?utm_source=feed&id={rng.randrange(10 ** 9)}"
+            for i in range(num_urls)]
+
+
+def ids_per_second(function: Callable[[str], object], urls: List[str]) -> float:
+    start = time.perf_counter()
+    for url in urls:
+        function(url)
+    return len(urls) / (time.perf_counter() - start)
+
+
+def bytes_per_url(build: Callable[[], object], num_urls: int) -> float:
+    tracemalloc.start()
+    container = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return size / num_urls
+
+
+def run(num_urls: int) -> Dict[str, float]:
+    urls = make_urls(num_urls)
+    digests = [url_digest(url) for url in urls]
+
+    def build_hex_set() -> object:
+        return {digest.hex() for digest in digests}
+
+    def build_seen_set() -> object:
+        seen = SeenSet()
+        seen.update(digests)
+        len(seen)
+        return seen
+
+    # Unique urls miss the cache of url_digest, so its overhead is measured on a first pass over them, and its
+    # gain on a second pass over as many urls as the cache holds.
+    url_digest.cache_clear()
+    cache_misses = ids_per_second(compute_id, urls)
+    cached_urls = urls[:url_digest.cache_info().maxsize]
+    url_digest.cache_clear()
+    ids_per_second(compute_id, cached_urls)
+    cache_hits = ids_per_second(compute_id, cached_urls)
+    return {"urls": num_urls,
+            "ids_per_second_uncached": round(ids_per_second(url_digest.__wrapped__, urls)),
+            "ids_per_second_cache_misses": round(cache_misses),
+            "ids_per_second_cache_hits": round(cache_hits),
+            "bytes_per_url_hex_set": round(bytes_per_url(build_hex_set, num_urls), 1),
+            "bytes_per_url_seen_set": round(bytes_per_url(build_seen_set, num_urls), 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark url id computation and the memory use of seen ids.")
+    parser.add_argument("--urls", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.urls)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f"{name:>30}: {value}")
@@ -0,0 +1,149 @@
+import os
+import socket
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp.abc
+
+# A local stand-in for the web, used by the benchmarks and tests. Every GET is answered with a small HTML page after
+# a fixed delay, which makes throughput depend on how many requests the client keeps in flight.
+#
+# GET /fixture/<name>[/...] answers with the saved document src/tests/fixtures/<name>.html instead. The latency,
+# status and size of single responses can be set with the query parameters latency, status and size, e.g.,
+# /page/1?status=503 or /page/2?size=100000. Pages have an ETag, and a GET with a matching If-None-Match is answered
+# with 304 Not Modified.
+
+PAGE = ("<html><head><title>Stub page</title></head><body>" +
+        "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 40 +
+        "</body></html>").encode("utf-8")
+PARAGRAPH = b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>"
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tests", "fixtures")
+
+
+def page_of_size(size: int) -> bytes:
+    """ Returns an HTML page of about `size` bytes, made of as many paragraphs as needed. """
+    head, tail = PAGE.split(b"<p>", 1)[0], b"</body></html>"
+    num_paragraphs = max(1, (size - len(head) - len(tail)) // len(PARAGRAPH))
+    return head + PARAGRAPH * num_paragraphs + tail
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> Dict[str, bytes]:
+    fixtures = {}
+    for name in os.listdir(directory):
+        if name.endswith(".html"):
+            with open(os.path.join(directory, name), "rb") as input_file:
+                fixtures[name[:-len(".html")]] = input_file.read()
+    return fixtures
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Responses are written in pieces; without this, Nagle's algorithm and delayed ACKs add ~40 ms per request.
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 503
+    page = PAGE
+    fixtures: Dict[str, bytes] = {}
+
+    def do_GET(self):
+        path = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(path.query).items()}
+        latency = float(params.get("latency", self.latency))
+        if latency > 0:
+            time.sleep(latency)
+        status = int(params.get("status", 200))
+        if status == 200 and self._fails(path.path):
+            status = self.error_status
+        if status >= 400:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        parts = path.path.split("/")
+        if len(parts) > 2 and parts[1] == "fixture" and parts[2] in self.fixtures:
+            body = self.fixtures[parts[2]]
+        elif "size" in params:
+            body = page_of_size(int(params["size"]))
+        else:
+            body = self.page
+        etag = '"{:08x}"'.format(zlib.crc32(body))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fails(self, path: str) -> bool:
+        # Whether a path fails depends on the path alone, so runs with the same urls fail the same way.
+        return self.error_rate > 0 and zlib.crc32(path.encode("utf-8")) % 10000 < self.error_rate * 10000
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    """
+    Runs a threaded HTTP server on localhost in a background thread. Use as a context manager.
+
+    `latency` delays every response, `error_rate` is the share of paths answered with `error_status`, and
+    `page_size` sets the size of the default page in bytes.
+    """
+
+    def __init__(self, latency: float = 0.0, port: int = 0, error_rate: float = 0.0, error_status: int = 503,
+                 page_size: Optional[int] = None):
+        handler = type("Handler", (StubHandler,), {"latency": latency,
+                                                   "error_rate": error_rate,
+                                                   "error_status": error_status,
+                                                   "page": page_of_size(page_size) if page_size else PAGE,
+                                                   "fixtures": load_fixtures()})
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        # The backlog is set before listening; with the default of 5, bursts of connects are dropped and retried.
+        self._server.request_queue_size = 1024
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalResolver(aiohttp.abc.AbstractResolver):
+    """
+    Resolves every hostname to 127.0.0.1. Pass to AsyncFetcher to send requests for any url, e.g.,
+    http://arxiv.org:<port>/fixture/arxiv, to a StubServer, so that the url still picks the TextExtractor handler.
+    """
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, object]]:
+        return [{"hostname": host, "host": "127.0.0.1", "port": port, "family": socket.AF_INET, "proto": 0,
+                 "flags": socket.AI_NUMERICHOST}]
+
+    async def close(self) -> None:
+        pass
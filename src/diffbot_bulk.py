@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Dict, Iterable, Iterator, List, Tuple
+
+import requests
+
+from src.store import DocumentStore
+from src.third_party.diffbot import DiffbotBulk
+from src.url_id import compute_id
+
+# The jobStatus of a bulk job that has processed all its urls: "Job has completed and no repeat is scheduled."
+JOB_COMPLETE = 9
+# The jobStatus of a job that will not process its urls: "No URLs were added", and the statuses from 10 on, of jobs
+# that failed or were stopped by Diffbot.
+JOB_NO_URLS = 5
+JOB_FAILED_FROM = 10
+
+
+class BulkJobFailed(Exception):
+    pass
+
+
+def batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class DiffbotBulkExtractor(object):
+    """
+    Extracts urls with the Diffbot Bulk API instead of one Analyze API call per url. The urls are sent to Diffbot
+    in jobs of `batch_size` urls each. The status of a job is polled with backoff, from `poll_interval` up to
+    `max_poll_interval` seconds between polls. Once the job is complete, its output is streamed into the store,
+    which writes it in bulk, and the job is deleted. The blocking calls to Diffbot run in the default executor,
+    so several jobs can be run at once, e.g., by a BoundedScheduler.
+
+    The documents have the same shape as those of the per url path, with the object Diffbot extracted from the
+    url in `objects`. Urls that Diffbot could not process are missing from the output and are not stored.
+    """
+
+    def __init__(self, token: str, store: DocumentStore, batch_size: int = 1000, poll_interval: float = 5.0,
+                 max_poll_interval: float = 60.0, job_timeout: float = 6 * 3600.0, name_prefix: str = "extractor",
+                 replace: bool = False):
+        self.token = token
+        self.store = store
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.job_timeout = job_timeout
+        self.name_prefix = name_prefix
+        self.replace = replace
+
+    def jobs(self, urls: Iterable[Tuple[str, str]]) -> Iterator[Awaitable[str]]:
+        """
+        Returns one job per batch of the (id, url) pairs, read lazily as the jobs are started. The jobs of each call
+        are named apart from those of other processes using the same token, e.g., other workers.
+        """
+        run_id = "{}-{}".format(int(time.time()), uuid.uuid4().hex[:8])
+        for number, batch in enumerate(batches(urls, self.batch_size)):
+            yield self.run_job(f"{self.name_prefix}-{run_id}-{number}", batch)
+
+    async def run_job(self, name: str, items: List[Tuple[str, str]]) -> str:
+        loop = asyncio.get_event_loop()
+        start_time = time.time()
+        job = None
+        try:
+            job = await loop.run_in_executor(None, lambda: DiffbotBulk(self.token, name, [url for _, url in items]))
+            if not await self._wait(job):
+                print("Bulk job {} did not complete within {} seconds, storing what it processed".format(
+                    name, self.job_timeout))
+            ids = {url: id for id, url in items}
+            objects = job.iter_download()
+            num_stored = 0
+            while True:
+                # The download is consumed one store batch at a time, so it is never held in memory as a whole.
+                batch = await loop.run_in_executor(None, lambda: list(itertools.islice(objects, self.store.batch_size)))
+                if not batch:
+                    break
+                for diffbot_object in batch:
+                    await self._save(self.document(diffbot_object, ids))
+                    num_stored += 1
+        except (requests.RequestException, ValueError, BulkJobFailed) as error:
+            return "Bulk job {} of {} urls failed: {}".format(name, len(items), error)
+        finally:
+            # Also jobs that failed or timed out, so that they are not left on the Diffbot account.
+            if job is not None:
+                try:
+                    await loop.run_in_executor(None, job.delete)
+                except (requests.RequestException, ValueError) as error:
+                    print("Could not delete bulk job {}: {}".format(name, error))
+        return "Bulk job {} extracted {} of {} urls in {} seconds.".format(name, num_stored, len(items),
+                                                                          time.time() - start_time)
+
+    async def _wait(self, job: DiffbotBulk) -> bool:
+        """
+        Polls the status of the job until it is complete. Returns False if it timed out. Raises BulkJobFailed if
+        Diffbot does not know the job, or reports that it failed.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = time.monotonic() + self.job_timeout
+        interval = self.poll_interval
+        while time.monotonic() < deadline:
+            await asyncio.sleep(interval)
+            status = await loop.run_in_executor(None, job.job_status)
+            if status is None:
+                raise BulkJobFailed("the job is not known to Diffbot")
+            code = status.get("status")
+            if code == JOB_COMPLETE:
+                return True
+            if code == JOB_NO_URLS or (code is not None and code >= JOB_FAILED_FROM):
+                raise BulkJobFailed("status {}: {}".format(code, status.get("message", "")))
+            interval = min(self.max_poll_interval, 1.5 * interval)
+        return False
+
+    async def _save(self, document: Dict[str, object]) -> None:
+        if self.replace:
+            await self.store.replace(document)
+        else:
+            await self.store.insert(document)
+
+    @staticmethod
+    def document(diffbot_object: Dict[str, object], ids: Dict[str, str]) -> Dict[str, object]:
+        url = diffbot_object.get("pageUrl", "")
+        return {"_id": ids.get(url) or compute_id(url),
+                "request": {"pageUrl": url, "api": "analyze"},
+                "objects": [diffbot_object],
+                "text_extracted_at": datetime.utcnow()}
@@ -0,0 +1,198 @@
+import codecs
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+import aiohttp.abc
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+MAX_BODY_SIZE = 5 * 1024 * 1024
+NOT_MODIFIED = 304
+CHUNK_SIZE = 64 * 1024
+# Raised for urls that can not be fetched however often they are tried. aiohttp 3.10 and later raise
+# NonHttpUrlClientError for urls of other schemes, e.g., ftp://.
+INVALID_URL_ERRORS = (aiohttp.InvalidURL,) + ((aiohttp.NonHttpUrlClientError,)
+                                              if hasattr(aiohttp, "NonHttpUrlClientError") else ())
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+
+class FetchError(Exception):
+    """ A response that was deliberately not read to the end. `reason` is stored as the failure reason. """
+    reason = "Fetch error"
+
+
+class ResponseTooLarge(FetchError):
+    reason = "Response too large"
+
+
+class UnsupportedContentType(FetchError):
+    reason = "Unsupported content type"
+
+
+def parse_content_type(header: Optional[str]) -> Tuple[str, Optional[str]]:
+    """ Returns the lower cased media type and the charset parameter, if any, of a Content-Type header. """
+    if not header:
+        return "", None
+    media_type, _, parameters = header.partition(";")
+    charset = None
+    for parameter in parameters.split(";"):
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "charset" and value.strip():
+            charset = value.strip().strip("\"'")
+    return media_type.strip().lower(), charset
+
+
+def check_content_type(header: Optional[str], allowed: Iterable[str] = HTML_CONTENT_TYPES) -> None:
+    """ Raises UnsupportedContentType unless the media type is allowed. A missing Content-Type is allowed. """
+    media_type, _ = parse_content_type(header)
+    if media_type and media_type not in allowed:
+        raise UnsupportedContentType(f"Content type {media_type} is not one of {', '.join(allowed)}")
+
+
+def header_value(headers: Dict[str, str], name: str) -> Optional[str]:
+    """ Returns the value of the header, looked up regardless of case, or None. """
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def sniff_encoding(body: bytes, content_type: Optional[str] = None) -> str:
+    """
+    Returns the encoding of an HTML body from, in order, a byte order mark, the charset of the Content-Type header,
+    or a <meta> charset declaration in the first 2 KB. Defaults to UTF-8. Unlike full charset detection, this
+    never looks at more than the start of the body.
+    """
+    candidates = []
+    for bom, encoding in _BOMS:
+        if body.startswith(bom):
+            candidates.append(encoding)
+            break
+    candidates.append(parse_content_type(content_type)[1])
+    match = _META_CHARSET.search(body, 0, 2048)
+    if match:
+        candidates.append(match.group(1).decode("ascii"))
+    for candidate in candidates:
+        if candidate:
+            try:
+                return codecs.lookup(candidate).name
+            except LookupError:
+                continue
+    return "utf-8"
+
+
+class FetchResponse(NamedTuple):
+    status: int
+    url: str
+    headers: Dict[str, str]
+    body: bytes
+    encoding: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def not_modified(self) -> bool:
+        """ True if a conditional GET found the stored copy of the page current. """
+        return self.status == NOT_MODIFIED
+
+    @property
+    def text(self) -> str:
+        """ The body, decoded on access. Bytes that do not decode are replaced rather than raising an error. """
+        return self.body.decode(self.encoding, errors="replace")
+
+
+class AsyncFetcher(object):
+    """
+    Non-blocking HTTP client shared by all fetch paths of a run. All requests go through one pooled
+    aiohttp session, so connections are kept alive and DNS lookups are cached between requests to the
+    same host. Create one instance per run, and close it when the run is done.
+    """
+
+    def __init__(self, limit: int = 300, limit_per_host: int = 8, connect_timeout: float = 10.0,
+                 read_timeout: float = 30.0, dns_cache_ttl: int = 300, keepalive_timeout: float = 30.0,
+                 headers: Optional[Dict[str, str]] = None, max_body_size: int = MAX_BODY_SIZE,
+                 allowed_content_types: Iterable[str] = HTML_CONTENT_TYPES,
+                 trace_configs: Optional[List[aiohttp.TraceConfig]] = None,
+                 resolver: Optional[aiohttp.abc.AbstractResolver] = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = headers or {}
+        self.max_body_size = max_body_size
+        self.allowed_content_types = tuple(allowed_content_types)
+        self.trace_configs = trace_configs
+        self.resolver = resolver
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session binds to the running event loop, so it is created on first use rather than in __init__.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             use_dns_cache=True,
+                                             ttl_dns_cache=self.dns_cache_ttl,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             resolver=self.resolver)
+            timeout = aiohttp.ClientTimeout(total=None,
+                                            sock_connect=self.connect_timeout,
+                                            sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers,
+                                                  trace_configs=self.trace_configs)
+        return self._session
+
+    async def get(self, url: str, params: Optional[Dict[str, str]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> FetchResponse:
+        """
+        GET the url, following redirects, and return the status, final url, headers and body. The body is streamed
+        in chunks, and the download is aborted with UnsupportedContentType as soon as the headers show a media type
+        that is not allowed, or with ResponseTooLarge once it exceeds `max_body_size` bytes. The body of an error
+        response is not downloaded at all, and a 304 Not Modified has none. Pass If-None-Match or If-Modified-Since
+        in `headers` to make the GET conditional.
+        """
+        session = self._get_session()
+        async with session.get(url, params=params, headers=headers, allow_redirects=True) as response:
+            content_type = response.headers.get("Content-Type")
+            if response.status >= 400 or response.status == NOT_MODIFIED:
+                return FetchResponse(response.status, str(response.url), dict(response.headers), b"", "utf-8")
+            try:
+                check_content_type(content_type, self.allowed_content_types)
+                if response.content_length is not None and response.content_length > self.max_body_size:
+                    raise ResponseTooLarge(f"Content-Length {response.content_length} exceeds {self.max_body_size}")
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    body += chunk
+                    if len(body) > self.max_body_size:
+                        raise ResponseTooLarge(f"Body exceeds {self.max_body_size} bytes")
+            except FetchError:
+                # Drop the connection instead of reading the rest of the body to reuse it.
+                response.close()
+                raise
+            body = bytes(body)
+            return FetchResponse(response.status, str(response.url), dict(response.headers), body,
+                                 sniff_encoding(body, content_type))
+
+    async def get_json(self, url: str, params: Optional[Dict[str, str]] = None) -> object:
+        """ GET the url and return the decoded JSON body. Raises aiohttp.ClientResponseError on HTTP errors. """
+        session = self._get_session()
+        async with session.get(url, params=params, allow_redirects=True) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
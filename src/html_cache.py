@@ -0,0 +1,221 @@
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.dat$")
+INDEX_NAME = "index.jsonl"
+
+
+class CachedPage(NamedTuple):
+    id: str
+    url: str
+    body: bytes
+    encoding: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors="replace")
+
+
+class _Entry(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    codec: str
+    url: str
+    encoding: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+def _compress(body: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(body)
+    return "gzip", gzip.compress(body, compresslevel=6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The cache holds zstd compressed pages, but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def worker_cache_directories(directory: str) -> List[str]:
+    """ Returns the caches of --worker processes, kept in subdirectories of `directory` named by worker id. """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.path for entry in os.scandir(directory)
+                  if entry.is_dir() and os.path.exists(os.path.join(entry.path, INDEX_NAME)))
+
+
+class HtmlCache(object):
+    """
+    A local cache of fetched response bodies, keyed by url id (see src.url_id.compute_id), so that pages can be
+    extracted again without downloading them.
+
+    Bodies are compressed (zstd if the zstandard package is installed, gzip otherwise) and appended to segment
+    files of up to `segment_size` bytes. An append-only JSON lines index maps ids to their place in the segments,
+    along with the ETag and Last-Modified headers for conditional requests. Once the segments take more than
+    `max_size` bytes, whole segments are evicted, least recently used first. Recency is tracked for the lifetime
+    of the cache object; segments are ordered by modification time when the cache is opened.
+
+    The cache is safe to use from several threads of one process. Use one directory per process.
+    """
+
+    def __init__(self, directory: str, max_size: int = 10 * 1024 ** 3, segment_size: int = 256 * 1024 ** 2):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._segment_sizes: Dict[int, int] = {}
+        self._segment_access: Dict[int, float] = {}
+        self._readers: Dict[int, object] = {}
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                path = os.path.join(directory, name)
+                segment = int(match.group(1))
+                self._segment_sizes[segment] = os.path.getsize(path)
+                self._segment_access[segment] = os.path.getmtime(path)
+        self._load_index()
+        self._segment = max(self._segment_sizes, default=0)
+        self._writer = None
+        self._index = open(os.path.join(directory, INDEX_NAME), "a", encoding="utf-8")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "segment-{:06d}.dat".format(segment))
+
+    def _load_index(self) -> None:
+        path = os.path.join(self.directory, INDEX_NAME)
+        if not os.path.exists(path):
+            return
+        num_records = 0
+        with open(path, encoding="utf-8") as index:
+            for line in index:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record cut short by a crash; everything before it is intact.
+                    continue
+                num_records += 1
+                if "evicted_segment" in record:
+                    self._drop_segment_entries(record["evicted_segment"])
+                elif record["segment"] in self._segment_sizes:
+                    id = record.pop("id")
+                    self._entries[id] = _Entry(**record)
+        if num_records > 2 * len(self._entries) + 1000:
+            self._rewrite_index()
+
+    def _rewrite_index(self) -> None:
+        path = os.path.join(self.directory, INDEX_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as index:
+            for id, entry in self._entries.items():
+                index.write(json.dumps(dict(id=id, **entry._asdict())) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def _drop_segment_entries(self, segment: int) -> None:
+        for id in [id for id, entry in self._entries.items() if entry.segment == segment]:
+            del self._entries[id]
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return sum(self._segment_sizes.values())
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def validators(self, id: str) -> Tuple[Optional[str], Optional[str]]:
+        """ Returns the ETag and Last-Modified headers the page was served with, for a conditional request. """
+        entry = self._entries.get(id)
+        if entry is None:
+            return None, None
+        return entry.etag, entry.last_modified
+
+    def put(self, id: str, url: str, body: bytes, encoding: str = "utf-8",
+            headers: Optional[Dict[str, str]] = None) -> None:
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        codec, data = _compress(body)
+        with self._lock:
+            if self._writer is None or self._segment_sizes.get(self._segment, 0) + len(data) > self.segment_size:
+                self._start_segment()
+            offset = self._segment_sizes[self._segment]
+            self._writer.write(data)
+            self._writer.flush()
+            self._segment_sizes[self._segment] = offset + len(data)
+            self._segment_access[self._segment] = time.time()
+            entry = _Entry(self._segment, offset, len(data), codec, url, encoding,
+                           headers.get("etag"), headers.get("last-modified"), time.time())
+            self._entries[id] = entry
+            self._index.write(json.dumps(dict(id=id, **entry._asdict())) + "\n")
+            self._index.flush()
+            self._evict()
+
+    def get(self, id: str) -> Optional[CachedPage]:
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None:
+                return None
+            reader = self._readers.get(entry.segment)
+            if reader is None:
+                reader = self._readers[entry.segment] = open(self._segment_path(entry.segment), "rb")
+            reader.seek(entry.offset)
+            data = reader.read(entry.length)
+            self._segment_access[entry.segment] = time.time()
+        return CachedPage(id, entry.url, _decompress(entry.codec, data), entry.encoding, entry.etag,
+                          entry.last_modified, entry.fetched_at)
+
+    def _start_segment(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._segment += 1
+        self._segment_sizes[self._segment] = 0
+        self._segment_access[self._segment] = time.time()
+        self._writer = open(self._segment_path(self._segment), "ab")
+
+    def _evict(self) -> None:
+        while self.size > self.max_size and len(self._segment_sizes) > 1:
+            candidates = [s for s in self._segment_sizes if s != self._segment]
+            segment = min(candidates, key=lambda s: self._segment_access[s])
+            reader = self._readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+            os.remove(self._segment_path(segment))
+            del self._segment_sizes[segment]
+            del self._segment_access[segment]
+            self._drop_segment_entries(segment)
+            self._index.write(json.dumps({"evicted_segment": segment}) + "\n")
+            self._index.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+            self._index.close()
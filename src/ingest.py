@@ -0,0 +1,152 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from urllib.parse import urlsplit
+
+from src.store import DocumentStore
+from src.url_id import BloomFilter, SeenSet, id_to_digest, url_digest
+
+T = TypeVar("T")
+
+JSON_LINES_SUFFIXES = (".jsonl", ".ndjson", ".json")
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+class UrlSource(object):
+    """
+    Reads urls lazily from a CSV or JSON lines file, optionally gzip compressed (e.g., urls.csv.gz or
+    urls.jsonl.gz). The url is taken from the column, or key, `url_field` of each row. Progress is reported as the
+    number of bytes of the input file consumed so far, which is known without reading the file up front.
+    """
+
+    def __init__(self, path: str, url_field: str = "url"):
+        self.path = path
+        self.url_field = url_field
+        self.total_bytes = os.path.getsize(path)
+        self._raw: Optional[io.FileIO] = None
+        self._bytes_read = 0
+
+    @property
+    def bytes_read(self) -> int:
+        if self._raw is not None and not self._raw.closed:
+            return self._raw.tell()
+        return self._bytes_read
+
+    def __iter__(self) -> Iterator[str]:
+        name = self.path[:-3] if self.path.endswith(".gz") else self.path
+        with io.FileIO(self.path, "r") as raw:
+            self._raw = raw
+            binary = gzip.GzipFile(fileobj=raw) if self.path.endswith(".gz") else io.BufferedReader(raw)
+            with io.TextIOWrapper(binary, encoding="utf-8", newline="") as text:
+                if name.endswith(JSON_LINES_SUFFIXES):
+                    for line in text:
+                        if line.strip():
+                            url = json.loads(line).get(self.url_field)
+                            if url:
+                                yield url
+                else:
+                    for row in csv.DictReader(text):
+                        url = row.get(self.url_field)
+                        if url:
+                            yield url
+                self._bytes_read = raw.tell()
+
+
+def new_urls(urls: Iterable[str], store: Optional[DocumentStore], seen: Optional[SeenSet] = None,
+             known: Union[SeenSet, BloomFilter, None] = None, batch_size: int = 1000) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (id, url) for the urls that are not yet stored, in input order. Duplicates within the input are dropped
+    using `seen`, which ends up holding the digests of all urls of the input. Urls in the `known` index are skipped
+    without a lookup; the remaining ones are looked up in the store with one query per `batch_size` urls. Pass
+    None as store to rely on the `known` index alone.
+    """
+    seen = SeenSet() if seen is None else seen
+    urls = iter(urls)
+    while True:
+        rows = list(islice(urls, batch_size))
+        if not rows:
+            return
+        batch: Dict[str, str] = {}
+        for url in rows:
+            digest = url_digest(url)
+            if digest not in seen:
+                seen.add(digest)
+                if known is None or digest not in known:
+                    batch[digest.hex()] = url
+        if not batch:
+            continue
+        existing_ids = store.find_existing_ids(batch) if store is not None else set()
+        if known is not None:
+            known.update(id_to_digest(id) for id in existing_ids)
+        for id, url in batch.items():
+            if id not in existing_ids:
+                yield id, url
+
+
+def interleave_by_host(urls: Iterable[T], buffer_size: int = 10000, seed: Optional[int] = None,
+                       key: Callable[[T], str] = host_of) -> Iterator[T]:
+    """
+    Reorders urls so that consecutive urls come from different hosts, without reading the whole input. Up to
+    `buffer_size` urls are held back, grouped by host, and emitted round-robin over the hosts in the buffer, which
+    are visited in random order. Pass `key` to reorder items other than plain urls, e.g., (id, url) tuples.
+    """
+    rng = random.Random(seed)
+    per_host: Dict[str, Deque[T]] = {}
+    hosts: Deque[str] = deque()
+    num_buffered = 0
+
+    def take() -> T:
+        host = hosts.popleft()
+        queue = per_host[host]
+        url = queue.popleft()
+        if queue:
+            hosts.append(host)
+        else:
+            del per_host[host]
+        return url
+
+    for url in urls:
+        host = key(url)
+        queue = per_host.get(host)
+        if queue is None:
+            queue = per_host[host] = deque()
+            hosts.insert(rng.randint(0, len(hosts)), host)
+        queue.append(url)
+        num_buffered += 1
+        if num_buffered >= buffer_size:
+            num_buffered -= 1
+            yield take()
+    while hosts:
+        yield take()
+
+
+async def prefetch(items: Iterable[T], batch_size: int = 1000) -> AsyncIterator[T]:
+    """
+    Yields the items of a blocking iterable, e.g., new_urls reading a file and looking up ids in MongoDb, without
+    running it on the event loop. The iterable is advanced in a thread, `batch_size` items at a time, and the next
+    batch is read while the items of the previous one are consumed.
+    """
+    loop = asyncio.get_event_loop()
+    items = iter(items)
+    next_batch = loop.run_in_executor(None, _take, items, batch_size)
+    while True:
+        batch = await next_batch
+        if not batch:
+            return
+        next_batch = loop.run_in_executor(None, _take, items, batch_size)
+        for item in batch:
+            yield item
+
+
+def _take(items: Iterator[T], count: int) -> List[T]:
+    return list(islice(items, count))
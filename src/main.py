@@ -1,202 +1,554 @@
+import argparse
 import asyncio
+import json
 import logging
+import os
+import subprocess
+import sys
 from datetime import datetime
 
 import pymongo
-import csv
-import hashlib
 import time
-from typing import Dict, List
-import random
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 
-import requests
-from w3lib.url import canonicalize_url, url_query_cleaner
+import aiohttp
 from pymongo.collection import Collection
-from pymongo.errors import DocumentTooLarge
 
-from src.text_extractor import TextExtractor
+from src.diffbot_bulk import DiffbotBulkExtractor
+from src.fetcher import INVALID_URL_ERRORS, AsyncFetcher, FetchError, header_value
+from src.html_cache import HtmlCache, worker_cache_directories
+from src.ingest import UrlSource, host_of, interleave_by_host, new_urls, prefetch
+from src.metrics import METRICS, SamplingProfiler
+from src.parse_pool import HtmlTooLarge, ParsePool, ParseTimeout, ParseWorkerDied
+from src.rate_limit import TokenBucket
+from src.refresh import RefreshPolicy, conditional_headers, content_hash, text_hash, validators
+from src.retry import CircuitBreaker, Retrier, RetryPolicy, parse_retry_after
 from src.third_party.diffbot import DiffbotClient
-from src.third_party import asyncioplus
+from src.scheduler import BoundedScheduler
+from src.store import DocumentStore, operation_id
+from src.url_id import SeenSet, id_to_digest, open_known_ids
+from src.work_queue import WorkQueue, default_worker_id
 
 
-def set_up_db(db: str, collection: str) -> Collection:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
+def set_up_db(db: str, collection: str, uri: str = "mongodb://localhost:27017/") -> Collection:
+    client = pymongo.MongoClient(uri)
     return client[db][collection]
 
 
-logging.basicConfig(level=logging.DEBUG)
-
 HTTP_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36",
     "Accept-Language": "en-US;q=0.8,en;q=0.7"}
 
+# All Diffbot calls go to the same host, which is thus paused as a whole by the circuit breaker.
+DIFFBOT_HOST = urlsplit(DiffbotClient.base_url).hostname
 
-def diffbot_extract(url: str, access_token: str) -> Dict[str, object]:
-    diffbot = DiffbotClient()
-    try:
-        response = diffbot.request(url, access_token, "analyze")
-    except requests.exceptions.HTTPError as error:
-        print("Got error when calling Diffbot for url: {} - {}".format(error, url))
-        response = None
-    return response
-
-
-def read_urls_from_csv(csv_file: str, url_field: str, collection: Collection) -> List[str]:
-    result = []
-    num_docs_in_db = 0
-    print("Reading urls from file: {}".format(csv_file))
-    with open(csv_file, newline="") as input_file:
-        reader = csv.DictReader(input_file)
-        for row in reader:
-            url = row[url_field]
-            id = compute_id(url)
-            document = collection.find_one({"_id": id})
-            if document is None:
-                result.append(row[url_field])
-            else:
-                num_docs_in_db += 1
-    print("Got {} new urls and skipped {} existing urls.".format(len(result), num_docs_in_db, csv_file))
-    random.shuffle(result)
-    return result
 
+async def diffbot_extract(url: str, access_token: str, fetcher: AsyncFetcher,
+                          rate_limiter: Optional[TokenBucket] = None) -> Dict[str, object]:
+    params = {"url": url, "token": access_token}
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
+    return await fetcher.get_json(DiffbotClient().compose_url("analyze", 3), params=params)
 
-def compute_id(url: str) -> str:
-    normalized_url = canonicalize_url(url_query_cleaner(url, [], remove=False))
-    return hashlib.md5(normalized_url.encode('utf-8')).hexdigest()
 
+def failure_document(id: str, url: str, reason: str) -> Dict[str, object]:
+    METRICS.inc("failures_total", reason=reason)
+    return {"_id": id,
+            "url": url,
+            "text_extracted_at": datetime.utcnow(),
+            "extraction_status_ok": False,
+            "extraction_fail_reason": reason
+            }
 
-@asyncio.coroutine
-async def extract_async_text(url: str, collection: Collection) -> str:
-    id = compute_id(url)
-    document = collection.find_one({"_id": id})
-    if document is None:
-        start_time = time.time()
-        try:
-            response = requests.get(url, allow_redirects=True, headers=HTTP_HEADERS)
-        except requests.exceptions.SSLError as ssl_error:
-            result = f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {ssl_error}"
-            collection.insert_one(
-                {"_id": id,
-                 "url": url,
-                 "text_extracted_at": datetime.utcnow(),
-                 "extraction_status_ok": False,
-                 "extraction_fail_reason": "SSL error"
-                 }
-            )
-            return result
-        except requests.exceptions.ConnectionError as connection_error:
-            result = f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {connection_error}"
-            collection.insert_one(
-                {"_id": id,
-                 "url": url,
-                 "text_extracted_at": datetime.utcnow(),
-                 "extraction_status_ok": False,
-                 "extraction_fail_reason": "Connection error"
-                 }
-            )
-            return result
-        except requests.exceptions.ContentDecodingError as decoding_error:
-            result = f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - gor error: {decoding_error}"
-            collection.insert_one(
-                {"_id": id,
-                 "url": url,
-                 "text_extracted_at": datetime.utcnow(),
-                 "extraction_status_ok": False,
-                 "extraction_fail_reason": "Decoding error"
-                 }
-            )
-            return result
-        except requests.exceptions.ChunkedEncodingError as chunked_error:
-            result = f"Could not retrieve url {url}. Failed after {time.time() - start_time} seconds - got error: {chunked_error}"
-            collection.insert_one(
-                {"_id": id,
-                 "url": url,
-                 "text_extracted_at": datetime.utcnow(),
-                 "extraction_status_ok": False,
-                 "extractoin_fail_reason": "Chunked encoding error"
-                 }
-            )
-            return result
-        if response.ok:
-            title, text = TextExtractor.extract_text(response.text, url=url)
-            try:
-                collection.insert_one(
-                    {"_id": id,
-                     "url": url,
-                     "title": title,
-                     "text": text,
-                     "text_extracted_at": datetime.utcnow(),
-                     "extraction_status_ok": True
-                     })
-                result = f"Extracted text from url {url} in {(time.time() - start_time)} seconds"
-            except DocumentTooLarge as error:
-                print(f"Got error: {error} for document with title: '{title}' and url: {url}")
-                result = f"Could not extract document from {url} - too large document. Time {time.time() - start_time} seconds."
+
+async def extract_async_text(id: str, url: str, store: DocumentStore, fetcher: AsyncFetcher, parser: ParsePool,
+                             cache: Optional[HtmlCache] = None, retrier: Optional[Retrier] = None, attempt: int = 0,
+                             replace: bool = False, previous: Optional[Dict[str, object]] = None) -> str:
+    """
+    Fetch the url, extract its text and store it. Pass the stored document of the url as `previous` to refresh it:
+    the GET is then conditional, and the document is rewritten only if the extracted text changed. Otherwise only
+    its `checked_at` is updated, and failures are recorded without touching the stored text.
+    """
+    start_time = time.time()
+    save = store.replace if replace else store.insert
+    host = host_of(url)
+
+    async def fail(reason: str) -> None:
+        if previous is None:
+            await save(failure_document(id, url, reason))
         else:
-            result = f"Response status: {response.status_code} - Could not extract data from url {url}. Failed after {(time.time()) - start_time}"
-            collection.insert_one(
-                {"_id": id,
-                 "url": url,
-                 "text_extracted_at": datetime.utcnow(),
-                 "extraction_status_ok": False,
-                 "extraction_fail_reason": f"Extraction error - HTTP status: {response.status_code}"
-                 }
-            )
+            METRICS.inc("failures_total", reason=reason)
+            await store.update(id, {"checked_at": datetime.utcnow(), "refresh_fail_reason": reason})
+
+    async def unchanged(fields: Dict[str, object], check: str) -> None:
+        await store.update(id, dict(fields, checked_at=datetime.utcnow()), unset=["refresh_fail_reason"])
+        METRICS.inc("unchanged_total", check=check)
+
+    def retry(reason: str, retry_after: Optional[float] = None) -> Optional[str]:
+        # Transient failures are re-scheduled, and only stored once the retries are used up.
+        if retrier is None:
+            return None
+        delay = retrier.retry(host, attempt, lambda: extract_async_text(id, url, store, fetcher, parser, cache,
+                                                                        retrier, attempt + 1, replace, previous),
+                              retry_after)
+        if delay is None:
+            return None
+        return f"{reason} for url {url} on attempt {attempt + 1}. Retrying in {delay:.1f} seconds"
+
+    try:
+        with METRICS.timer("download_seconds", host=METRICS.host(host)):
+            response = await fetcher.get(url, headers=conditional_headers(previous, cache)
+                                         if previous is not None else None)
+    except FetchError as fetch_error:
+        await fail(fetch_error.reason)
+        return f"Could not retrieve url {url}. Aborted after {(time.time()) - start_time} seconds: {fetch_error}"
+    except aiohttp.ClientSSLError as ssl_error:
+        await fail("SSL error")
+        return f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {ssl_error}"
+    except aiohttp.ClientPayloadError as payload_error:
+        await fail("Decoding error")
+        return f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {payload_error}"
+    except INVALID_URL_ERRORS as url_error:
+        # Not retried, and not counted against the host: a malformed url may have no host at all.
+        await fail("Invalid url")
+        return f"Could not retrieve url {url} - got error: {url_error}"
+    except aiohttp.TooManyRedirects as redirect_error:
+        await fail("Too many redirects")
+        return f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {redirect_error}"
+    except asyncio.TimeoutError:
+        result = retry("Timeout")
+        if result is None:
+            await fail("Timeout")
+            result = f"Could not retrieve url {url}. Timed out after {(time.time()) - start_time} seconds"
+        return result
+    except aiohttp.ClientConnectionError as connection_error:
+        # Includes the server closing the connection.
+        result = retry("Connection error")
+        if result is None:
+            await fail("Connection error")
+            result = f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {connection_error}"
+        return result
+    except aiohttp.ClientError as client_error:
+        await fail("Client error")
+        return f"Could not retrieve url {url}. Failed after {(time.time()) - start_time} seconds - got error: {client_error}"
+    METRICS.inc("responses_total", status=response.status)
+    if response.not_modified and previous is not None:
+        if retrier is not None:
+            retrier.record_success(host)
+        await unchanged(validators(response.headers), "not modified")
+        return f"Url {url} not modified since it was last checked"
+    if response.ok:
+        if retrier is not None:
+            retrier.record_success(host)
+        # Stored whether or not the text changed, so that the next refresh can skip the page as early as possible.
+        page = dict(validators(response.headers), content_hash=content_hash(response.body))
+        if previous is not None and page["content_hash"] == previous.get("content_hash"):
+            await unchanged(page, "content hash")
+            return f"Content of url {url} unchanged since it was last checked"
+        if cache is not None:
+            await asyncio.get_event_loop().run_in_executor(None, cache.put, id, url, response.body,
+                                                           response.encoding, response.headers)
+        try:
+            title, text = await parser.extract_text(response.text, url)
+        except HtmlTooLarge as error:
+            await fail("HTML too large")
+            return f"Could not extract text from url {url} - {error}"
+        except ParseTimeout as error:
+            await fail("Parse timeout")
+            return f"Could not extract text from url {url} - {error}"
+        except ParseWorkerDied as error:
+            await fail("Parse worker died")
+            return f"Could not extract text from url {url} - {error}"
+        page["text_hash"] = text_hash(title, text)
+        previous_text_hash = previous.get("text_hash") if previous is not None else None
+        if previous is not None and previous_text_hash is None:
+            # Documents stored before text hashes were kept are compared with their stored text, which is only
+            # read for them. The hash is then stored with the document, whether or not the text changed.
+            stored = await store.run(store.find_one, id, ["title", "text"])
+            if stored is not None:
+                previous_text_hash = text_hash(stored.get("title", ""), stored.get("text", ""))
+        if previous_text_hash is not None and page["text_hash"] == previous_text_hash:
+            await unchanged(page, "text hash")
+            return f"Text of url {url} unchanged since it was last checked"
+        await save(dict(
+            {"_id": id,
+             "url": url,
+             "title": title,
+             "text": text,
+             "text_extracted_at": datetime.utcnow(),
+             "extraction_status_ok": True
+             }, **page))
+        METRICS.inc("extracted_total")
+        result = f"Extracted text from url {url} in {(time.time() - start_time)} seconds"
     else:
-        result = f"Document already in database: {url}"
+        result = None
+        if retrier is not None:
+            if retrier.policy.is_retryable(response.status):
+                result = retry(f"Response status: {response.status}", retry_after_of(response.headers))
+            else:
+                # The host answers; the url itself is the problem.
+                retrier.record_success(host)
+        if result is None:
+            result = f"Response status: {response.status} - Could not extract data from url {url}. Failed after {(time.time()) - start_time}"
+            await fail(f"Extraction error - HTTP status: {response.status}")
     return result
 
 
-@asyncio.coroutine
-async def extract_async_diffbot(diffbot_api_token: str, url: str, collection: Collection) -> str:
-    id = compute_id(url)
-    document = collection.find_one({"_id": id})
-    if document is None:
-        start_time = time.time()
-        response = diffbot_extract(url, diffbot_api_token)
-        if response is not None:
-            if "errorCode" in response:
-                print("Error in retrieving data from Diffbot. Error code {}: {}".format(response["errorCode"],
-                                                                                        response["error"]))
-                result = "Could not extract data: {}".format(response["error"])
-            else:
-                response["_id"] = id
-                response["text_extracted_at"] = datetime.utcnow()
-                collection.insert_one(response)
-                result = "Extracted text from url {} in {} seconds.".format(url, (time.time() - start_time))
+def retry_after_of(headers: Dict[str, str]) -> Optional[float]:
+    return parse_retry_after(header_value(headers, "Retry-After"))
+
+
+async def reextract_async_text(id: str, store: DocumentStore, parser: ParsePool, cache: HtmlCache) -> str:
+    start_time = time.time()
+    page = await asyncio.get_event_loop().run_in_executor(None, cache.get, id)
+    if page is None:
+        return f"Page {id} is no longer cached"
+    try:
+        title, text = await parser.extract_text(page.text, page.url)
+    except (HtmlTooLarge, ParseTimeout, ParseWorkerDied) as error:
+        return f"Could not extract text from cached url {page.url} - {error}"
+    # With the validators and hashes of the cached page, as stored by extract_async_text, for --refresh. The page
+    # was last checked when it was fetched.
+    page_validators = {name: value for name, value in (("etag", page.etag), ("last_modified", page.last_modified))
+                       if value}
+    await store.replace(dict(
+        {"_id": id,
+         "url": page.url,
+         "title": title,
+         "text": text,
+         "text_extracted_at": datetime.utcnow(),
+         "extraction_status_ok": True,
+         "content_hash": content_hash(page.body),
+         "text_hash": text_hash(title, text),
+         "checked_at": datetime.utcfromtimestamp(page.fetched_at)
+         }, **page_validators))
+    return f"Re-extracted text from cached url {page.url} in {(time.time() - start_time)} seconds"
+
+
+async def extract_async_diffbot(diffbot_api_token: str, id: str, url: str, store: DocumentStore,
+                                fetcher: AsyncFetcher, retrier: Optional[Retrier] = None, attempt: int = 0,
+                                replace: bool = False, rate_limiter: Optional[TokenBucket] = None) -> str:
+    start_time = time.time()
+
+    def retry(retry_after: Optional[float] = None) -> Optional[float]:
+        if retrier is None:
+            return None
+        return retrier.retry(DIFFBOT_HOST, attempt, lambda: extract_async_diffbot(
+            diffbot_api_token, id, url, store, fetcher, retrier, attempt + 1, replace, rate_limiter), retry_after)
+
+    try:
+        with METRICS.timer("diffbot_seconds"):
+            response = await diffbot_extract(url, diffbot_api_token, fetcher, rate_limiter)
+    except aiohttp.ClientResponseError as error:
+        print("Got error when calling Diffbot for url: {} - {}".format(error, url))
+        if retrier is not None and retrier.policy.is_retryable(error.status):
+            delay = retry(retry_after_of(error.headers or {}))
+            if delay is not None:
+                return "Diffbot responded {} for url {}. Retrying in {:.1f} seconds".format(error.status, url, delay)
+        response = None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        print("Could not reach Diffbot for url: {} - {}".format(error, url))
+        delay = retry()
+        if delay is not None:
+            return "Could not reach Diffbot for url {}. Retrying in {:.1f} seconds".format(url, delay)
+        response = None
+    if response is not None:
+        if retrier is not None:
+            retrier.record_success(DIFFBOT_HOST)
+        if "errorCode" in response:
+            print("Error in retrieving data from Diffbot. Error code {}: {}".format(response["errorCode"],
+                                                                                    response["error"]))
+            METRICS.inc("failures_total", reason="Diffbot error {}".format(response["errorCode"]))
+            result = "Could not extract data: {}".format(response["error"])
         else:
-            result = "Nothing extracted."
+            response["_id"] = id
+            response["text_extracted_at"] = datetime.utcnow()
+            if replace:
+                await store.replace(response)
+            else:
+                await store.insert(response)
+            METRICS.inc("extracted_total")
+            result = "Extracted text from url {} in {} seconds.".format(url, (time.time() - start_time))
     else:
-        result = "Document already in the database: {}".format(url)
+        result = "Nothing extracted."
     return result
 
 
-async def execute_tasks(tasks, num_tasks: int):
+async def execute_tasks(tasks, scheduler: BoundedScheduler, source: Optional[UrlSource] = None,
+                        print_every: int = 1):
+    """ Run the tasks, printing the result of every `print_every`:th task along with the progress of the run. """
     num_tasks_completed = 0
-    for result in asyncioplus.limited_as_completed(tasks, 300):
+    async for task in scheduler.as_completed(tasks):
         num_tasks_completed += 1
-        print("{}/{} Done: {}".format(num_tasks_completed, num_tasks, await result), flush=True)
+        result = await task
+        METRICS.set("tasks_completed", num_tasks_completed)
+        METRICS.set("tasks_in_flight", scheduler.in_flight)
+        METRICS.set("tasks_queued", scheduler.queued)
+        if num_tasks_completed % print_every:
+            continue
+        if source is not None:
+            print("{} Done, {:.1f}% of input read ({} in flight, {} queued): {}".format(
+                num_tasks_completed, 100.0 * source.bytes_read / max(source.total_bytes, 1), scheduler.in_flight,
+                scheduler.queued, result), flush=True)
+        else:
+            print("{} Done ({} in flight, {} queued): {}".format(num_tasks_completed, scheduler.in_flight,
+                                                                 scheduler.queued, result), flush=True)
 
 
 if __name__ == "__main__":
-    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    argument_parser = argparse.ArgumentParser(description="Download and extract the contents of urls in parallel.")
+    argument_parser.add_argument("--reextract", action="store_true",
+                                 help="Extract the text of all pages in the HTML cache again, without fetching them.")
+    argument_parser.add_argument("--retry-failed", nargs="*", metavar="REASON",
+                                 help="Fetch the urls of stored failures again, e.g., --retry-failed Timeout "
+                                      "'Connection error'. Without reasons, all failures are retried.")
+    argument_parser.add_argument("--refresh", action="store_true",
+                                 help="Fetch stored documents older than the time to live of their host again, with "
+                                      "conditional GETs, and rewrite those whose text changed.")
+    argument_parser.add_argument("--enqueue", action="store_true",
+                                 help="Add the urls of the input file to the work queue shared by --worker processes.")
+    argument_parser.add_argument("--worker", action="store_true",
+                                 help="Fetch urls leased from the work queue, until it is empty.")
+    argument_parser.add_argument("--worker-id", default=None,
+                                 help="A name for the worker that stays the same across restarts. Defaults to the "
+                                      "hostname.")
+    argument_parser.add_argument("--workers", type=int, default=None, metavar="N",
+                                 help="Start N --worker processes on this machine and wait for them to finish.")
+    argument_parser.add_argument("--worker-number", type=int, nargs=2, default=None, metavar=("I", "N"),
+                                 help="Set by --workers: run as worker I of N on this machine, with a share of its "
+                                      "CPUs and connections.")
+    argument_parser.add_argument("--profile", default=None, metavar="FILE",
+                                 help="Sample the stack of the event loop and write it to FILE, in the collapsed "
+                                      "format of flame graph tools.")
+    args = argument_parser.parse_args()
+    if args.refresh and (args.worker or args.reextract or args.retry_failed is not None):
+        argument_parser.error("--refresh can not be combined with --worker, --reextract or --retry-failed")
 
     ### CONFIGURE
     diffbot_api_token = None
-    input_file = "/Users/fredriko/Dropbox/data/metacurate-urls/urls.csv"
+    diffbot_calls_per_second = None  # E.g. 5, as given by your Diffbot plan.
+    diffbot_bulk = False  # Use the Diffbot Bulk API instead of one call per url.
+    diffbot_bulk_batch_size = 1000
+    max_diffbot_bulk_jobs = 4
+    input_file = "/Users/fredriko/Dropbox/data/metacurate-urls/urls.csv"  # CSV or JSON lines, optionally gzipped.
     name_of_url_field = "url"
+    shuffle_buffer_size = 10000
+    refresh_ttl = 7 * 24 * 3600.0  # Seconds after which --refresh fetches a document again.
+    host_refresh_ttls = {}  # E.g. {"arxiv.org": 30 * 24 * 3600.0}, for hosts and their subdomains.
+    known_ids_index = None  # E.g. "known_ids.idx", or "known_ids.bloom" for a Bloom filter. Skips MongoDb lookups.
+    known_ids_capacity = 100000000  # Urls a new Bloom filter is sized for, at 1.2 bytes per url and a 1% error rate.
+    known_ids_error_rate = 0.01  # Share of new urls a Bloom filter skips as known.
+    mongo_uri = "mongodb://localhost:27017/"
     db_name = "texts"
     db_collection_name = "plain_text_w_title"
+    html_cache_directory = None  # E.g. "html_cache". Keeps the fetched pages for --reextract.
+    html_cache_max_size = 10 * 1024 ** 3
+    max_connections = 300
+    max_connections_per_host = 8
+    politeness_delay = 0.0
+    parse_workers = None  # Defaults to the number of CPUs.
+    parse_timeout = 30.0
+    max_html_size = 5 * 1024 * 1024
+    max_body_size = 5 * 1024 * 1024  # Downloads are aborted beyond this many bytes.
+    write_batch_size = 1000
+    write_flush_interval = 1.0
+    connect_timeout = 10.0
+    read_timeout = 30.0
+    max_retries = 3  # Retries of timeouts, connection errors and HTTP statuses such as 429 and 503.
+    retry_base_delay = 1.0
+    retry_max_delay = 120.0
+    host_failure_threshold = 5  # Consecutive failures before a host is paused.
+    host_pause = 60.0  # Doubled every time the host fails again after a pause.
+    work_queue_collection_name = "work_queue"
+    lease_batch_size = 100
+    lease_timeout = 1800.0  # Seconds after which urls leased by a worker that has stopped are leased again.
+    max_lease_attempts = 3
+    log_level = logging.INFO
+    print_results_every = 1  # E.g. 1000 to print only every 1000:th result.
+    metrics_port = None  # E.g. 9100 to serve the metrics at http://localhost:9100/metrics.
+    metrics_snapshot_file = None  # E.g. "metrics.json", written every metrics_snapshot_interval seconds.
+    metrics_snapshot_interval = 10.0
     ### END CONFIGURE
 
-    collection = set_up_db(db_name, db_collection_name)
-    urls = read_urls_from_csv(input_file, name_of_url_field, collection)
+    logging.basicConfig(level=log_level)
+    logging.getLogger("aiohttp").setLevel(logging.WARNING)
 
-    if diffbot_api_token is not None:
-        tasks = (extract_async_diffbot(diffbot_api_token, url, collection) for url in urls)
-    else:
-        tasks = (extract_async_text(url, collection) for url in urls)
+    if args.workers is not None:
+        # Each worker is a process of its own, with its own event loop, connections and parse pool.
+        command = [sys.executable, "-m", __spec__.name] if __spec__ is not None else [sys.executable, sys.argv[0]]
+        worker_id = args.worker_id or default_worker_id()
+        workers = [subprocess.Popen(command + ["--worker", "--worker-id", "{}-{}".format(worker_id, number),
+                                               "--worker-number", str(number), str(args.workers)])
+                   for number in range(args.workers)]
+        # A worker killed by a signal has a negative return code.
+        return_codes = [worker.wait() for worker in workers]
+        failed = [code for code in return_codes if code != 0]
+        if failed:
+            print("{} of {} workers failed, with return codes {}".format(len(failed), len(workers), failed))
+        sys.exit(1 if failed else 0)
+
+    collection = set_up_db(db_name, db_collection_name, mongo_uri)
+    queue = None
+    if args.enqueue or args.worker:
+        queue = WorkQueue(set_up_db(db_name, work_queue_collection_name, mongo_uri),
+                          args.worker_id or default_worker_id(), lease_timeout, max_lease_attempts)
+    if args.enqueue:
+        source = UrlSource(input_file, name_of_url_field)
+        print("Adding urls from file {} to the work queue".format(input_file))
+        # A new export of the input to the same path is not resumed from the checkpoint of the previous one.
+        input_stat = os.stat(input_file)
+        checkpoint_name = "{}:{}:{}".format(os.path.abspath(input_file), input_stat.st_size, input_stat.st_mtime)
+        queue.enqueue_input(checkpoint_name, source, DocumentStore(collection))
+        print("Urls in the work queue per state: {}".format(queue.counts()))
+        sys.exit(0)
+    if args.worker:
+        print("Released {} urls leased by {} before a restart".format(queue.release(), queue.worker_id))
+        if html_cache_directory is not None:
+            html_cache_directory = os.path.join(html_cache_directory, queue.worker_id)
+        if metrics_snapshot_file is not None:
+            # E.g. metrics-host-0.json for metrics.json.
+            name, extension = os.path.splitext(metrics_snapshot_file)
+            metrics_snapshot_file = "{}-{}{}".format(name, queue.worker_id, extension)
+    if args.worker_number is not None:
+        # The workers started by --workers share the CPUs and the connection limits of this machine, and serve
+        # their metrics on ports of their own, from metrics_port on.
+        number, num_workers = args.worker_number
+        parse_workers = max(1, (parse_workers or os.cpu_count() or 1) // num_workers)
+        max_connections = max(1, max_connections // num_workers)
+        max_connections_per_host = max(1, max_connections_per_host // num_workers)
+        if metrics_port is not None:
+            metrics_port += number
 
+    store = DocumentStore(collection, batch_size=write_batch_size, flush_interval=write_flush_interval,
+                          on_written=queue.on_written if queue is not None else None)
+    parser = ParsePool(max_workers=parse_workers, parse_timeout=parse_timeout, max_html_size=max_html_size)
+    cache = HtmlCache(html_cache_directory, html_cache_max_size) if html_cache_directory is not None else None
     event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(execute_tasks(tasks, len(urls)))
+    known = written = None
+
+    if args.profile is not None:
+        METRICS.profiler = SamplingProfiler().start()
+    if metrics_port is not None:
+        METRICS.serve(metrics_port)
+        print("Serving metrics at http://localhost:{}/metrics".format(metrics_port))
+    monitors = [event_loop.create_task(METRICS.monitor_event_loop_lag())]
+    if metrics_snapshot_file is not None:
+        monitors.append(event_loop.create_task(METRICS.write_snapshots(metrics_snapshot_file,
+                                                                       metrics_snapshot_interval)))
+
+    try:
+        if args.reextract:
+            if cache is None:
+                argument_parser.error("--reextract needs html_cache_directory to be configured")
+            # The pages fetched by --worker processes are in a cache per worker.
+            caches = [cache] + [HtmlCache(directory, html_cache_max_size)
+                                for directory in worker_cache_directories(html_cache_directory)]
+            try:
+                print("Re-extracting {} cached pages from: {}".format(sum(map(len, caches)), html_cache_directory))
+                # Enough tasks to keep every parse worker busy; the parse pool holds back the rest.
+                scheduler = BoundedScheduler(2 * parser.max_pending)
+                tasks = (reextract_async_text(id, store, parser, page_cache)
+                         for page_cache in caches for id in page_cache.ids())
+                event_loop.run_until_complete(execute_tasks(tasks, scheduler, print_every=print_results_every))
+            finally:
+                for worker_cache in caches[1:]:
+                    worker_cache.close()
+        else:
+            source = None
+            prefetch_size = 1000
+            if args.worker:
+                # One lease at a time, so that urls are not leased long before they are fetched.
+                prefetch_size = lease_batch_size
+                # Urls are leased in the order of their ids, which are hashes, so hosts are mixed already.
+                urls = queue.leased_urls(lease_batch_size)
+            elif args.refresh:
+                if diffbot_api_token is not None:
+                    argument_parser.error("--refresh is only supported when extracting text without Diffbot")
+                print("Refreshing documents checked more than {} seconds ago".format(refresh_ttl))
+                urls = RefreshPolicy(refresh_ttl, host_refresh_ttls).due(store)
+            elif args.retry_failed is not None:
+                print("Stored failures per reason: {}".format(store.count_failure_reasons()))
+                urls = store.find_failed(args.retry_failed)
+            else:
+                source = UrlSource(input_file, name_of_url_field)
+                print("Reading urls from file: {}".format(input_file))
+                lookup_store = store
+                if known_ids_index is not None:
+                    # With an index of known ids from an earlier run, urls are not looked up in MongoDb at all.
+                    if os.path.exists(known_ids_index):
+                        lookup_store = None
+                    known = open_known_ids(known_ids_index, known_ids_capacity, known_ids_error_rate)
+                    # Only urls whose documents were written are added to the index, not those that failed to be
+                    # written, or that got no document, e.g., since the run stopped before they were extracted.
+                    written = SeenSet()
+
+                    def add_written(operations: List[object]) -> None:
+                        written.update(id_to_digest(id) for id in map(operation_id, operations))
+
+                    store.on_written = add_written
+                urls = new_urls(source, lookup_store, SeenSet(), known)
+            if not args.worker:
+                urls = interleave_by_host(urls, buffer_size=shuffle_buffer_size, key=lambda item: host_of(item[1]))
+            replace = args.retry_failed is not None or args.refresh
+
+            # All Diffbot calls go to the same host, so the per-host limit does not apply to that path.
+            if diffbot_api_token is not None:
+                max_connections_per_host = max_connections
+            fetcher = AsyncFetcher(limit=max_connections, limit_per_host=max_connections_per_host,
+                                   connect_timeout=connect_timeout, read_timeout=read_timeout, headers=HTTP_HEADERS,
+                                   max_body_size=max_body_size, trace_configs=[METRICS.trace_config()])
+            if diffbot_api_token is not None and diffbot_bulk:
+                scheduler = BoundedScheduler(max_diffbot_bulk_jobs)
+            elif diffbot_api_token is not None:
+                scheduler = BoundedScheduler(max_connections)
+            else:
+                scheduler = BoundedScheduler(max_connections, per_key_limit=max_connections_per_host,
+                                             politeness_delay=politeness_delay)
+            retrier = Retrier(scheduler, RetryPolicy(max_retries, retry_base_delay, retry_max_delay),
+                              CircuitBreaker(host_failure_threshold, host_pause))
+            # The input is read, ids are looked up in MongoDb, and urls are leased, by prefetch in a thread, so the
+            # event loop is not held up by them.
+            if diffbot_api_token is not None and diffbot_bulk:
+                bulk_extractor = DiffbotBulkExtractor(diffbot_api_token, store, batch_size=diffbot_bulk_batch_size,
+                                                      replace=replace)
+                tasks = prefetch(bulk_extractor.jobs(urls), batch_size=1)
+            elif diffbot_api_token is not None:
+                rate_limiter = TokenBucket(diffbot_calls_per_second) if diffbot_calls_per_second is not None else None
+                tasks = ((DIFFBOT_HOST, extract_async_diffbot(diffbot_api_token, id, url, store, fetcher, retrier,
+                                                              replace=replace, rate_limiter=rate_limiter))
+                         async for id, url in prefetch(urls, prefetch_size))
+            else:
+                if not args.refresh:
+                    urls = ((id, url, None) for id, url in urls)
+                tasks = ((host_of(url), extract_async_text(id, url, store, fetcher, parser, cache, retrier,
+                                                           replace=replace, previous=previous))
+                         async for id, url, previous in prefetch(urls, prefetch_size))
+
+            event_loop.run_until_complete(execute_tasks(tasks, scheduler, source, print_results_every))
+            event_loop.run_until_complete(fetcher.close())
+            print("Retried {} fetches, paused hosts {} times".format(retrier.num_retries, retrier.num_pauses))
+            if queue is not None:
+                event_loop.run_until_complete(store.flush())
+                # Urls leased by workers that stopped are leased again by workers still running, or by the next run.
+                print("Urls in the work queue per state: {}".format(queue.counts()))
+    finally:
+        for monitor in monitors:
+            monitor.cancel()
+        event_loop.run_until_complete(asyncio.gather(*monitors, return_exceptions=True))
+        if metrics_snapshot_file is not None:
+            with open(metrics_snapshot_file, "w", encoding="utf-8") as snapshot_file:
+                json.dump(METRICS.snapshot(), snapshot_file)
+        if METRICS.profiler is not None:
+            METRICS.profiler.stop()
+            METRICS.profiler.write(args.profile)
+        if cache is not None:
+            cache.close()
+        parser.shutdown()
+        # Also on errors, so that buffered writes are not lost. Last, since it raises if MongoDb can not be reached.
+        event_loop.run_until_complete(store.close())
+    if known is not None:
+        known.update(written)
+        known.save(known_ids_index)
+        known.close()
     event_loop.close()
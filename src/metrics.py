@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(object):
+    """ Counts observations per bucket, like a Prometheus histogram. Quantiles are estimated from the buckets. """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Returns the upper bound of the bucket holding the q-quantile, or infinity beyond the last bucket. """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return float("inf") if self.counts[-1] else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in pairs) + "}"
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of a run, with labels, e.g., the stage, host or failure reason.
+    Updates are cheap and thread safe, so they can be made on the hot path, both on the event loop and in the
+    thread pools. The metrics are read as a JSON snapshot, or in the Prometheus text format from serve().
+
+    Hosts are used as label values for the first `max_hosts` hosts seen only; later hosts are counted as "other",
+    so a run over millions of hosts does not grow the metrics without bounds.
+    """
+
+    def __init__(self, max_hosts: int = 1000):
+        self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._hosts = set()
+        self.started_at = time.time()
+        self.profiler: Optional[SamplingProfiler] = None
+
+    def host(self, host: str) -> str:
+        """ Returns the label value to use for the host. """
+        if host in self._hosts:
+            return host
+        with self._lock:
+            if len(self._hosts) < self.max_hosts:
+                self._hosts.add(host)
+                return host
+        return "other"
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """ Observe the time spent in the block, e.g., `with METRICS.timer("mongo_write_seconds"):`. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, List[Dict[str, object]]]:
+        """ Returns all metrics as a JSON serializable dictionary. """
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = [(key, histogram.to_dict()) for key, histogram in self._histograms.items()]
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "counters": [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in counters],
+            "gauges": [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in gauges],
+            "histograms": [dict(name=name, labels=dict(labels), **values) for (name, labels), values in histograms],
+        }
+
+    def to_prometheus(self) -> str:
+        """ Returns all metrics in the Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve the metrics from a background thread: /metrics in the Prometheus text format, /metrics.json as a
+        snapshot, and /profile with the stacks sampled so far, if a SamplingProfiler is attached to `profiler`.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot(), indent=2), "application/json"
+                elif self.path == "/profile" and metrics.profiler is not None:
+                    body, content_type = metrics.profiler.collapsed(), "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    async def write_snapshots(self, path: str, interval: float = 10.0) -> None:
+        """ Write a JSON snapshot of the metrics to `path` every `interval` seconds, until cancelled. """
+        while True:
+            await asyncio.sleep(interval)
+            with open(path + ".tmp", "w", encoding="utf-8") as output_file:
+                json.dump(self.snapshot(), output_file)
+            # Replaced in one step, so readers never see a partial snapshot.
+            os.replace(path + ".tmp", path)
+
+    async def monitor_event_loop_lag(self, interval: float = 0.25) -> None:
+        """
+        Observe how late the event loop wakes up a task that sleeps for `interval` seconds, until cancelled. A lag
+        beyond a few milliseconds means that something blocks the loop.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.observe("event_loop_lag_seconds", lag)
+            self.set("event_loop_lag_last_seconds", lag)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """ An aiohttp TraceConfig observing the time of DNS lookups and new connections, per host. """
+        trace_config = aiohttp.TraceConfig()
+        metrics = self
+
+        async def on_dns_start(session, context, params):
+            context.dns_start = time.perf_counter()
+
+        async def on_dns_end(session, context, params):
+            metrics.observe("dns_seconds", time.perf_counter() - context.dns_start)
+
+        async def on_connect_start(session, context, params):
+            context.connect_start = time.perf_counter()
+
+        async def on_connect_end(session, context, params):
+            metrics.observe("connect_seconds", time.perf_counter() - context.connect_start)
+
+        async def on_reuse(session, context, params):
+            metrics.inc("connections_reused_total")
+
+        trace_config.on_dns_resolvehost_start.append(on_dns_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_end)
+        trace_config.on_connection_create_start.append(on_connect_start)
+        trace_config.on_connection_create_end.append(on_connect_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+
+class SamplingProfiler(object):
+    """
+    An opt-in profiler for live runs. A background thread samples the stack of one thread, by default the one
+    that started the profiler, every `interval` seconds, and counts how often each stack is seen. The result is
+    in the collapsed format read by flame graph tools, e.g., flamegraph.pl and speedscope. Only the process that
+    runs the event loop is sampled; the parse workers are processes of their own.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None, max_depth: int = 64):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                with self._lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """ Returns the sampled stacks, one per line followed by its count, most frequent first. """
+        with self._lock:
+            most_common = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in most_common)
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as output_file:
+            output_file.write(self.collapsed())
+
+
+# The metrics of this process.
+METRICS = Metrics()
@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, Tuple
+
+from src.metrics import METRICS
+from src.text_extractor import TextExtractor
+
+
+class ParseTimeout(Exception):
+    pass
+
+
+class HtmlTooLarge(Exception):
+    pass
+
+
+class ParseWorkerDied(Exception):
+    """ The worker process parsing a document exited, e.g., after a crash in lxml, twice in a row. """
+    pass
+
+
+def _raise_parse_timeout(signum, frame):
+    raise ParseTimeout()
+
+
+def _extract_with_alarm(extract: Callable[[str, str], Tuple[str, str]], html: str, url: str,
+                        timeout: float) -> Tuple[str, str]:
+    # Runs in a worker process. The alarm interrupts runaway pure-Python parsing (e.g., in newspaper) inside the
+    # worker. Parsing stuck in C code does not see the alarm; ParsePool kills the worker processes in that case.
+    if timeout and hasattr(signal, "setitimer"):
+        previous_handler = signal.signal(signal.SIGALRM, _raise_parse_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return extract(html, url)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    return extract(html, url)
+
+
+class ParsePool(object):
+    """
+    Runs TextExtractor.extract_text in a pool of worker processes, so that parsing does not block the event loop.
+
+    At most `max_pending` documents are handed to the pool at any time. Coroutines calling extract_text wait for a
+    free slot, which in turn holds back the scheduler from starting new fetches while the parsers are saturated.
+    Documents longer than `max_html_size` characters are rejected with HtmlTooLarge, and a document that is not
+    parsed within `parse_timeout` seconds raises ParseTimeout.
+
+    The workers are started from a fork server by default, not forked from this process, which by then runs the
+    threads of the store, the metrics server and the profiler. As with spawn, a script using the pool must then
+    guard its entry point with `if __name__ == "__main__":`. Pass another `mp_context` to change that.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 parse_timeout: float = 30.0, max_html_size: int = 5 * 1024 * 1024,
+                 extract: Callable[[str, str], Tuple[str, str]] = TextExtractor.extract_text,
+                 mp_context: Optional[multiprocessing.context.BaseContext] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.parse_timeout = parse_timeout
+        self.max_html_size = max_html_size
+        self.extract = extract
+        self.mp_context = mp_context or _default_context()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+        return self._executor
+
+    def _kill(self, executor: ProcessPoolExecutor) -> None:
+        """ Terminate the workers of a pool with a runaway parse. Other documents in that pool are re-submitted. """
+        if self._executor is executor:
+            self._executor = None
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+
+    async def extract_text(self, html: str, url: str) -> Tuple[str, str]:
+        if len(html) > self.max_html_size:
+            raise HtmlTooLarge(f"Document of {len(html)} characters exceeds the limit of {self.max_html_size}")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_event_loop()
+        waiting_since = time.perf_counter()
+        async with self._slots:
+            start = time.perf_counter()
+            METRICS.observe("parse_slot_wait_seconds", start - waiting_since)
+            for attempt in range(2):
+                executor = self._get_executor()
+                future = loop.run_in_executor(executor, _extract_with_alarm, self.extract, html, url,
+                                              self.parse_timeout)
+                try:
+                    # The grace period gives the alarm in the worker a chance to fire before the workers are killed.
+                    result = await asyncio.wait_for(future, self.parse_timeout + 5.0)
+                    METRICS.observe("parse_seconds", time.perf_counter() - start,
+                                    handler=TextExtractor.handler_for(url).__name__)
+                    return result
+                except asyncio.TimeoutError:
+                    self._kill(executor)
+                    raise ParseTimeout(f"Parsing {url} did not finish within {self.parse_timeout} seconds")
+                except BrokenProcessPool:
+                    # Another document's timeout killed the pool this one was running in; try once more.
+                    if self._executor is executor:
+                        self._executor = None
+                    if attempt == 1:
+                        raise ParseWorkerDied(f"The parse worker exited while parsing {url}")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def _default_context() -> multiprocessing.context.BaseContext:
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context("forkserver")
+    # Workers are forked from a server that has imported the extractor already, so they start quickly.
+    context.set_forkserver_preload(["src.text_extractor"])
+    return context
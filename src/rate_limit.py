@@ -0,0 +1,37 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket(object):
+    """
+    Limits calls to `rate` per second on average, allowing bursts of up to `capacity` calls. Callers that find the
+    bucket empty reserve a token ahead of time and sleep until it is theirs, so waiting callers are served in the
+    order they arrived, without polling.
+
+    Usage:
+
+        limiter = TokenBucket(rate=5)
+        await limiter.acquire()
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """ Take `tokens` from the bucket. Returns the seconds to wait before they may be used. """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= tokens
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,76 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+
+from src.fetcher import header_value
+from src.html_cache import HtmlCache
+from src.ingest import host_of
+from src.store import DocumentStore
+
+
+def content_hash(data: bytes) -> str:
+    """ Returns the hex digest used to tell whether a page, or its extracted text, changed since it was stored. """
+    return hashlib.md5(data).hexdigest()
+
+
+def text_hash(title: str, text: str) -> str:
+    return content_hash(f"{title}\n{text}".encode("utf-8"))
+
+
+def validators(headers: Dict[str, str]) -> Dict[str, str]:
+    """ Returns the ETag and Last-Modified of a response, to be stored as `etag` and `last_modified`. """
+    found = {"etag": header_value(headers, "ETag"), "last_modified": header_value(headers, "Last-Modified")}
+    return {name: value for name, value in found.items() if value}
+
+
+def conditional_headers(document: Dict[str, object], cache: Optional[HtmlCache] = None) -> Dict[str, str]:
+    """
+    Returns the headers that turn a GET of a stored document into a conditional GET. If the document has no
+    validators, e.g., since it was stored before they were, those of its page in the `cache` are used.
+    """
+    etag, last_modified = document.get("etag"), document.get("last_modified")
+    if not etag and not last_modified and cache is not None:
+        etag, last_modified = cache.validators(document["_id"])
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class RefreshPolicy(object):
+    """
+    Decides which stored documents are due to be fetched again: those checked longer ago than the time to live of
+    their host. A document was last checked at its `checked_at`, or, if it was never refreshed, at its
+    `text_extracted_at`. The time to live of a host is the one given in `host_ttls` for the longest suffix of its
+    hostname, e.g., "arxiv.org" for export.arxiv.org, or `ttl` if there is none. Times to live are in seconds.
+    """
+
+    def __init__(self, ttl: float = 7 * 24 * 3600.0, host_ttls: Optional[Dict[str, float]] = None):
+        self.ttl = ttl
+        self.host_ttls = host_ttls or {}
+
+    def ttl_for(self, url: str) -> float:
+        hostname = host_of(url)
+        while hostname:
+            ttl = self.host_ttls.get(hostname)
+            if ttl is not None:
+                return ttl
+            _, _, hostname = hostname.partition(".")
+        return self.ttl
+
+    def is_due(self, document: Dict[str, object], now: datetime) -> bool:
+        checked_at = document.get("checked_at") or document.get("text_extracted_at")
+        return checked_at is None or checked_at < now - timedelta(seconds=self.ttl_for(document["url"]))
+
+    def due(self, store: DocumentStore, now: Optional[datetime] = None) -> Iterator[Tuple[str, str, Dict[str, object]]]:
+        """
+        Yields the id, url and stored document of every document that is due. Documents checked within the
+        shortest time to live are left out by the query; the rest are filtered by the time to live of their host.
+        """
+        now = now or datetime.utcnow()
+        shortest_ttl = min([self.ttl] + list(self.host_ttls.values()))
+        for document in store.find_checked_before(now - timedelta(seconds=shortest_ttl)):
+            if self.is_due(document, now):
+                yield document["_id"], document["url"], document
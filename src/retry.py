@@ -0,0 +1,136 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from src.scheduler import BoundedScheduler
+
+# Statuses that say "not now" rather than "never": timeouts, rate limiting and temporary server errors.
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Returns the seconds to wait given by a Retry-After header, either in seconds or as an HTTP date. """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter: the n:th retry waits a random time between 0 and
+    min(max_delay, base_delay * 2 ** n) seconds, so that retries of many failures at once are spread out instead of
+    arriving at the same time. A Retry-After given by the server is waited at least; one beyond `max_delay` is not
+    waited for at all, the attempt is given up instead.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 120.0,
+                 retryable_statuses: Iterable[int] = RETRYABLE_STATUSES):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_statuses = frozenset(retryable_statuses)
+
+    def is_retryable(self, status: int) -> bool:
+        return status in self.retryable_statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """ Seconds to wait before retrying after failed attempt number `attempt` (from 0), or None to give up. """
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None and retry_after > self.max_delay:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    Keeps count of consecutive failures per host. After `failure_threshold` of them the circuit opens, and the host
+    should be paused for the number of seconds returned by record_failure(). The first failure after a pause opens
+    the circuit again, for twice as long, up to `max_reset_timeout`; a success closes it. Failures reported while
+    the circuit is open, by requests that were already in flight, are not counted.
+
+    Only hosts with failures are kept, so memory does not grow with the number of healthy hosts.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0, max_reset_timeout: float = 3600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._failures: Dict[Hashable, int] = {}
+        self._times_opened: Dict[Hashable, int] = {}
+        self._open_until: Dict[Hashable, float] = {}
+
+    def is_open(self, key: Hashable) -> bool:
+        return self._open_until.get(key, 0.0) > time.monotonic()
+
+    def record_success(self, key: Hashable) -> None:
+        self._failures.pop(key, None)
+        self._times_opened.pop(key, None)
+        self._open_until.pop(key, None)
+
+    def record_failure(self, key: Hashable) -> float:
+        """ Count a failure for the host. Returns the seconds to pause the host for, or 0.0 if it is not paused. """
+        now = time.monotonic()
+        if self._open_until.get(key, 0.0) > now:
+            return 0.0
+        failures = self._failures.get(key, 0) + 1
+        if failures < self.failure_threshold:
+            self._failures[key] = failures
+            return 0.0
+        # Stay one failure short of the threshold, so that a failure of the first request after the pause opens
+        # the circuit again.
+        self._failures[key] = self.failure_threshold - 1
+        times_opened = self._times_opened.get(key, 0)
+        self._times_opened[key] = times_opened + 1
+        pause = min(self.max_reset_timeout, self.reset_timeout * 2 ** times_opened)
+        self._open_until[key] = now + pause
+        return pause
+
+
+class Retrier(object):
+    """
+    Re-schedules transient failures on a running BoundedScheduler. Retries are submitted with their backoff delay
+    and wait in the delayed queue of the scheduler, not in a slot, so fresh urls keep being fetched in the meantime.
+    Hosts whose circuit breaker opens are paused in the scheduler, which holds back both their fresh urls and their
+    retries until the pause is over.
+    """
+
+    def __init__(self, scheduler: BoundedScheduler, policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.scheduler = scheduler
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.num_retries = 0
+        self.num_pauses = 0
+
+    def record_success(self, key: Hashable) -> None:
+        """ Report that the host answered, even if with a permanent error such as 404. """
+        self.breaker.record_success(key)
+
+    def retry(self, key: Hashable, attempt: int, make_coro: Callable[[], Awaitable],
+              retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Report a transient failure of attempt number `attempt` (from 0) for the host `key`, and submit the coroutine
+        made by `make_coro` to try again. Returns the delay of the retry, or None if the attempt is given up.
+        """
+        pause = self.breaker.record_failure(key)
+        if pause > 0:
+            self.num_pauses += 1
+            print(f"Pausing {key} for {pause:.1f} seconds after repeated failures")
+            self.scheduler.pause(key, pause)
+        delay = self.policy.delay(attempt, retry_after)
+        if delay is None:
+            return None
+        self.num_retries += 1
+        self.scheduler.submit(make_coro(), key, delay)
+        return delay
@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import (AsyncIterable, AsyncIterator, Awaitable, Deque, Dict, Hashable, Iterable, List, Optional, Tuple,
+                    Union)
+
+from src.metrics import METRICS
+
+Job = Union[Awaitable, Tuple[Hashable, Awaitable]]
+
+
+class BoundedScheduler(object):
+    """
+    Runs coroutines from a (lazy) iterable with at most `limit` of them in flight at any time, and yields
+    each task as soon as it is done. The scheduler sleeps until a task completes, it never polls.
+
+    Jobs are either plain coroutines or (key, coroutine) tuples, where the key is typically the host of the
+    url being fetched. Jobs sharing a key are capped at `per_key_limit` in flight, and consecutive starts for a
+    key are spaced at least `politeness_delay` seconds apart. Jobs that can not start yet are parked, and at
+    most `max_queued` of them are read ahead from the input, so the input is never materialized. The time jobs
+    spend parked is observed as `queue_wait_seconds`.
+
+    The input may also be an async iterable, e.g., of urls looked up in a thread. It is then read by a task of its
+    own, at most `limit` jobs ahead of the scheduler, and the scheduler waits for it without blocking the loop.
+
+    Usage:
+
+        async for task in BoundedScheduler(300).as_completed(coros):
+            print(await task)
+    """
+
+    def __init__(self, limit: int, per_key_limit: Optional[int] = None, politeness_delay: float = 0.0,
+                 max_queued: int = 10000):
+        self.limit = limit
+        self.per_key_limit = per_key_limit
+        self.politeness_delay = politeness_delay
+        self.max_queued = max(1, max_queued)
+        self._in_flight_per_key: Dict[Hashable, int] = {}
+        self._next_start_per_key: Dict[Hashable, float] = {}
+        self._parked: Dict[Hashable, Deque[Tuple[Awaitable, float]]] = {}
+        self._num_parked = 0
+        self._delayed: List[Tuple[float, int, Hashable, Awaitable]] = []
+        self._counter = itertools.count()
+        self._running: Dict[asyncio.Future, Hashable] = {}
+        self._completed: Deque[asyncio.Future] = deque()
+        self._waiter: Optional[asyncio.Future] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    @property
+    def queued(self) -> int:
+        return self._num_parked + len(self._delayed)
+
+    def submit(self, coro: Awaitable, key: Hashable = None, delay: float = 0.0) -> None:
+        """ Add a job while the scheduler is running, e.g., to re-schedule a failed fetch after `delay` seconds. """
+        heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._counter), key, coro))
+        self._wake()
+
+    def pause(self, key: Hashable, seconds: float) -> None:
+        """ Start no job for `key` during the next `seconds` seconds; its jobs are parked until then. """
+        until = time.monotonic() + seconds
+        self._next_start_per_key[key] = max(self._next_start_per_key.get(key, 0.0), until)
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _on_done(self, task: asyncio.Future) -> None:
+        self._completed.append(task)
+        self._wake()
+
+    def _can_start(self, key: Hashable, now: float) -> bool:
+        if key is None:
+            return True
+        if self.per_key_limit is not None and self._in_flight_per_key.get(key, 0) >= self.per_key_limit:
+            return False
+        return self._next_start_per_key.get(key, 0.0) <= now
+
+    def _start(self, key: Hashable, coro: Awaitable, now: float) -> None:
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(self._on_done)
+        self._running[task] = key
+        if key is not None:
+            self._in_flight_per_key[key] = self._in_flight_per_key.get(key, 0) + 1
+            if self.politeness_delay > 0:
+                self._next_start_per_key[key] = now + self.politeness_delay
+
+    def _park(self, key: Hashable, coro: Awaitable, now: float) -> None:
+        self._parked.setdefault(key, deque()).append((coro, now))
+        self._num_parked += 1
+
+    def _fill(self, jobs, now: float) -> bool:
+        """ Start as many jobs as the limits allow. Returns False once the input iterator is exhausted. """
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, key, coro = heapq.heappop(self._delayed)
+            self._park(key, coro, now)
+        if self._num_parked > 0:
+            for key in list(self._parked):
+                if len(self._running) >= self.limit:
+                    break
+                parked = self._parked[key]
+                while parked and len(self._running) < self.limit and self._can_start(key, now):
+                    coro, parked_at = parked.popleft()
+                    METRICS.observe("queue_wait_seconds", now - parked_at)
+                    self._start(key, coro, now)
+                    self._num_parked -= 1
+                if not parked:
+                    del self._parked[key]
+        while jobs is not None and len(self._running) < self.limit and self._num_parked < self.max_queued:
+            try:
+                job = next(jobs)
+            except StopIteration:
+                return False
+            except _NotReady:
+                break
+            key, coro = job if isinstance(job, tuple) else (None, job)
+            if self._can_start(key, now):
+                self._start(key, coro, now)
+            else:
+                self._park(key, coro, now)
+        return jobs is not None
+
+    def _next_deadline(self, now: float) -> Optional[float]:
+        """ Seconds until a parked or delayed job may become startable without any task completing. """
+        if len(self._running) >= self.limit:
+            return None
+        deadlines = []
+        if self._delayed:
+            deadlines.append(self._delayed[0][0])
+        for key in self._parked:
+            if self.per_key_limit is None or self._in_flight_per_key.get(key, 0) < self.per_key_limit:
+                deadlines.append(self._next_start_per_key.get(key, now))
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+    def _finish(self, task: asyncio.Future) -> None:
+        key = self._running.pop(task)
+        if key is not None:
+            remaining = self._in_flight_per_key[key] - 1
+            if remaining:
+                self._in_flight_per_key[key] = remaining
+            else:
+                del self._in_flight_per_key[key]
+
+    async def as_completed(self, coros: Union[Iterable[Job], AsyncIterable[Job]]) -> AsyncIterator[asyncio.Future]:
+        loop = asyncio.get_event_loop()
+        jobs = _AsyncInput(coros, self.limit, self._wake) if hasattr(coros, "__aiter__") else iter(coros)
+        async_input = jobs if isinstance(jobs, _AsyncInput) else None
+        try:
+            while True:
+                now = time.monotonic()
+                if not self._fill(jobs, now):
+                    jobs = None
+                if self._completed:
+                    while self._completed:
+                        task = self._completed.popleft()
+                        self._finish(task)
+                        yield task
+                    continue
+                if not self._running and not self._num_parked and not self._delayed and jobs is None:
+                    break
+                timeout = self._next_deadline(now)
+                self._waiter = loop.create_future()
+                handle = loop.call_later(timeout, self._wake) if timeout is not None else None
+                try:
+                    await self._waiter
+                finally:
+                    self._waiter = None
+                    if handle is not None:
+                        handle.cancel()
+        finally:
+            if async_input is not None:
+                async_input.close()
+            for task in self._running:
+                task.remove_done_callback(self._on_done)
+                task.cancel()
+            for parked in self._parked.values():
+                for coro, _ in parked:
+                    _close(coro)
+            for _, _, _, coro in self._delayed:
+                _close(coro)
+            self._running.clear()
+            self._completed.clear()
+            self._parked.clear()
+            self._delayed.clear()
+            self._in_flight_per_key.clear()
+            self._num_parked = 0
+
+
+def _close(coro: Awaitable) -> None:
+    # Parked coroutines were never awaited; close them to avoid "was never awaited" warnings.
+    if asyncio.iscoroutine(coro):
+        coro.close()
+
+
+class _NotReady(Exception):
+    """ Raised by _AsyncInput when no job has been read yet, although more may follow. """
+    pass
+
+
+class _AsyncInput(object):
+    """ Reads an async iterable of jobs in a task of its own, at most `max_buffered` jobs ahead of the scheduler. """
+
+    def __init__(self, jobs: AsyncIterable[Job], max_buffered: int, on_ready):
+        self.max_buffered = max(1, max_buffered)
+        self._on_ready = on_ready
+        self._buffer: Deque[Job] = deque()
+        self._space: Optional[asyncio.Future] = None
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._task = asyncio.ensure_future(self._read(jobs))
+
+    async def _read(self, jobs: AsyncIterable[Job]) -> None:
+        try:
+            async for job in jobs:
+                self._buffer.append(job)
+                self._on_ready()
+                if len(self._buffer) >= self.max_buffered:
+                    self._space = asyncio.get_event_loop().create_future()
+                    await self._space
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self._error = error
+        finally:
+            self._done = True
+            self._on_ready()
+
+    def __next__(self) -> Job:
+        if self._buffer:
+            job = self._buffer.popleft()
+            if self._space is not None and not self._space.done():
+                self._space.set_result(None)
+            return job
+        if self._error is not None:
+            raise self._error
+        if self._done:
+            raise StopIteration
+        raise _NotReady()
+
+    def close(self) -> None:
+        self._task.cancel()
+        for job in self._buffer:
+            _close(job[1] if isinstance(job, tuple) else job)
+        self._buffer.clear()
@@ -0,0 +1,235 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DocumentTooLarge, PyMongoError
+
+from src.metrics import METRICS
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class DocumentStore(object):
+    """
+    Batched, non-blocking access to the MongoDb collection holding the extracted documents.
+
+    Lookups of already stored ids are done with one `$in` query per batch of ids, or with a single scan of all
+    ids projected on `_id`. Writes are buffered and sent as unordered bulk writes once `batch_size` writes are
+    pending, or at the latest `flush_interval` seconds after the previous flush. The blocking pymongo calls run in
+    a thread pool, so the event loop is never held up by the database. If given, `on_written` is called, in the
+    thread pool, with the operations of each batch that were written, i.e., without those that failed, e.g., with
+    DocumentTooLarge. Writes of documents that were already stored count as written. Batches that fail since
+    MongoDb can not be reached, e.g., with AutoReconnect, are kept in the buffer and written by a later flush.
+    """
+
+    def __init__(self, collection: Collection, batch_size: int = 1000, flush_interval: float = 1.0,
+                 lookup_batch_size: int = 1000, num_threads: int = 4,
+                 on_written: Optional[Callable[[List[object]], None]] = None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lookup_batch_size = lookup_batch_size
+        self.on_written = on_written
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._buffer: List[object] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Future] = None
+        self.num_written = 0
+
+    def find_existing_ids(self, ids: Iterable[str]) -> Set[str]:
+        """ Returns the subset of ids that are already stored, using one query per `lookup_batch_size` ids. """
+        ids = list(ids)
+        existing = set()
+        for i in range(0, len(ids), self.lookup_batch_size):
+            batch = ids[i:i + self.lookup_batch_size]
+            existing.update(d["_id"] for d in self.collection.find({"_id": {"$in": batch}}, {"_id": 1}))
+        return existing
+
+    def load_ids(self) -> Set[str]:
+        """ Returns the ids of all stored documents, read in a single scan projected on `_id`. """
+        return {d["_id"] for d in self.collection.find({}, {"_id": 1})}
+
+    def find_one(self, id: str, fields: Iterable[str]) -> Optional[Dict[str, object]]:
+        """ Returns the given fields of the stored document with the id, or None if there is none. """
+        return self.collection.find_one({"_id": id}, {name: 1 for name in fields})
+
+    def find_failed(self, reasons: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, str]]:
+        """ Yields the id and url of documents whose extraction failed, optionally only for the given reasons. """
+        query = {"extraction_status_ok": False}
+        if reasons:
+            query["extraction_fail_reason"] = {"$in": list(reasons)}
+        for document in self._find_in_pages(query, {"_id": 1, "url": 1}):
+            yield document["_id"], document["url"]
+
+    def find_checked_before(self, checked_before: datetime) -> Iterator[Dict[str, object]]:
+        """
+        Yields the url, validators and hashes of extracted documents last checked before `checked_before`, i.e.,
+        whose `checked_at`, or if they were never checked again, `text_extracted_at`, is older.
+        """
+        query = {"extraction_status_ok": True,
+                 "$or": [{"checked_at": {"$lt": checked_before}},
+                         {"checked_at": {"$exists": False}, "text_extracted_at": {"$lt": checked_before}}]}
+        projection = {"url": 1, "etag": 1, "last_modified": 1, "content_hash": 1, "text_hash": 1, "checked_at": 1,
+                      "text_extracted_at": 1}
+        yield from self._find_in_pages(query, projection)
+
+    def _find_in_pages(self, query: Dict[str, object], projection: Dict[str, int]) -> Iterator[Dict[str, object]]:
+        """
+        Yields the documents matching the query in `_id` order, reading `lookup_batch_size` of them at a time with a
+        query per page. No cursor is held open while the documents are processed, which may take longer than the
+        server keeps an idle cursor. Documents rewritten in the meantime are not visited twice.
+        """
+        last_id = None
+        while True:
+            page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+            page = list(self.collection.find(page_query, projection).sort("_id").limit(self.lookup_batch_size))
+            if not page:
+                return
+            yield from page
+            last_id = page[-1]["_id"]
+
+    def count_failure_reasons(self) -> Dict[str, int]:
+        """ Returns the number of failed documents per failure reason. """
+        pipeline = [{"$match": {"extraction_status_ok": False}},
+                    {"$group": {"_id": "$extraction_fail_reason", "count": {"$sum": 1}}}]
+        return {d["_id"]: d["count"] for d in self.collection.aggregate(pipeline)}
+
+    async def run(self, function: Callable, *args) -> object:
+        """ Run a blocking call against the database in the thread pool of the store. """
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    async def insert(self, document: Dict[str, object]) -> None:
+        await self.write(InsertOne(document))
+
+    async def replace(self, document: Dict[str, object]) -> None:
+        """ Write the document whether or not one with the same `_id` is already stored. """
+        await self.write(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+
+    async def update(self, id: str, fields: Dict[str, object], unset: Iterable[str] = ()) -> None:
+        """ Set `fields` of the stored document with the id, and remove the fields in `unset`. """
+        update = {"$set": fields}
+        if unset:
+            update["$unset"] = {name: "" for name in unset}
+        await self.write(UpdateOne({"_id": id}, update))
+
+    async def write(self, operation: object) -> None:
+        """ Buffer a pymongo write operation, e.g., InsertOne, ReplaceOne or UpdateOne. """
+        if self._flusher is None:
+            self._flush_lock = asyncio.Lock()
+            self._flusher = asyncio.ensure_future(self._flush_periodically())
+        self._buffer.append(operation)
+        if len(self._buffer) >= self.batch_size:
+            await self._try_flush()
+
+    async def flush(self) -> None:
+        """
+        Write the buffered operations. If MongoDb can not be reached, e.g., with AutoReconnect, the operations are
+        put back in the buffer, to be written by the next flush, and the error is raised.
+        """
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            operations, self._buffer = self._buffer, []
+            try:
+                written = await self.run(self._bulk_write, operations)
+                if self.on_written is not None and written:
+                    await self.run(self.on_written, written)
+            except PyMongoError:
+                # Written again in full; documents already written are then duplicates, which are ignored.
+                self._buffer = operations + self._buffer
+                raise
+
+    async def _try_flush(self) -> None:
+        try:
+            await self.flush()
+        except PyMongoError as error:
+            print(f"Could not write {len(self._buffer)} documents, retrying in {self.flush_interval} seconds: {error}")
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._try_flush()
+
+    def _bulk_write(self, operations: List[object]) -> List[object]:
+        with METRICS.timer("mongo_write_seconds"):
+            written = self._write_batch(operations)
+        METRICS.inc("mongo_operations_total", len(operations))
+        return written
+
+    def _write_batch(self, operations: List[object]) -> List[object]:
+        """ Writes the operations, and returns those that were written. """
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            self.num_written += result.inserted_count + result.upserted_count + result.modified_count
+            return operations
+        except BulkWriteError as error:
+            # Documents that are already stored, e.g., by another process, are not an error.
+            details = error.details
+            self.num_written += details.get("nInserted", 0) + details.get("nUpserted", 0) + details.get("nModified", 0)
+            failed = _failed_indexes(details)
+            return [operation for i, operation in enumerate(operations) if i not in failed]
+        except DocumentTooLarge:
+            # A single document too large for MongoDb fails the whole batch. Write the batch one by one instead.
+            written = []
+            for operation in operations:
+                try:
+                    if self._bulk_write_one(operation):
+                        written.append(operation)
+                except DocumentTooLarge as error:
+                    print(f"Got error: {error} for document: {_describe(operation)}")
+            return written
+
+    def _bulk_write_one(self, operation: object) -> bool:
+        try:
+            self.collection.bulk_write([operation], ordered=False)
+            self.num_written += 1
+            return True
+        except BulkWriteError as error:
+            return not _failed_indexes(error.details)
+
+    async def close(self, attempts: int = 3) -> None:
+        """
+        Flush all pending writes and stop the background flushing. A final flush that fails is tried `attempts`
+        times in all, `flush_interval` seconds apart, before its error is raised.
+        """
+        try:
+            if self._flusher is not None:
+                self._flusher.cancel()
+                await asyncio.gather(self._flusher, return_exceptions=True)
+                self._flusher = None
+                for attempt in range(1, attempts + 1):
+                    try:
+                        await self.flush()
+                        break
+                    except PyMongoError as error:
+                        if attempt == attempts:
+                            print(f"Could not write {len(self._buffer)} documents: {error}")
+                            raise
+                        await asyncio.sleep(self.flush_interval)
+        finally:
+            self._executor.shutdown(wait=True)
+
+def _failed_indexes(details: Dict[str, object]) -> Set[int]:
+    """ Prints the errors of a bulk write, other than duplicate keys, and returns the indexes of their operations. """
+    failed = set()
+    for write_error in details.get("writeErrors", []):
+        if write_error.get("code") != DUPLICATE_KEY_ERROR:
+            print(f"Got error when writing document: {write_error.get('errmsg')}")
+            failed.add(write_error.get("index"))
+    return failed
+
+
+def operation_id(operation: object) -> Optional[str]:
+    """ Returns the _id of a pymongo InsertOne, ReplaceOne or UpdateOne. """
+    document = getattr(operation, "_doc", None) or getattr(operation, "_filter", None) or {}
+    return document.get("_id")
+
+
+def _describe(operation: object) -> str:
+    document = getattr(operation, "_doc", None) or {}
+    return f"'{document.get('title', '')}' with url: {document.get('url', '')}"
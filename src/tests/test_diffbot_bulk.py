@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from src.diffbot_bulk import DiffbotBulkExtractor
+from src.store import DocumentStore
+from src.third_party.diffbot import DiffbotClient, iter_json_array
+from src.url_id import compute_id
+
+
+class FakeDiffbot(BaseHTTPRequestHandler):
+    """
+    Answers the Bulk API calls for jobs kept in `jobs`, a job being complete after two status polls. Jobs with a
+    url containing "failing" fail, and those with a url containing "lost" are forgotten once started.
+    """
+    protocol_version = "HTTP/1.1"
+    jobs = {}
+
+    def respond(self, status, payload, chunked=False):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if chunked:
+            # Sent in small pieces without a Content-Length, to exercise the streaming download.
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i in range(0, len(body), 100):
+                self.wfile.write(body[i:i + 100])
+                self.wfile.flush()
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        if "lost" not in params["urls"][0]:
+            self.jobs[params["name"][0]] = {"urls": params["urls"][0].split(), "polls": 0}
+        self.respond(200, {"response": "Successfully added urls for spidering."})
+
+    def do_GET(self):
+        path = urlsplit(self.path)
+        params = parse_qs(path.query)
+        if path.path.startswith("/v3/bulk/download/"):
+            name = path.path[len("/v3/bulk/download/token-"):-len("_data.json")]
+            objects = [{"type": "article", "pageUrl": url, "title": f"Title of {url}", "text": "Grüße " * 20}
+                       for url in self.jobs[name]["urls"] if "unprocessable" not in url]
+            self.respond(200, objects, chunked=True)
+        elif "delete" in params:
+            self.jobs.pop(params["name"][0], None)
+            self.respond(200, {"response": "Successfully deleted job."})
+        elif params["name"][0] not in self.jobs:
+            self.respond(200, {"jobs": []})
+        else:
+            job = self.jobs[params["name"][0]]
+            job["polls"] += 1
+            status = 9 if job["polls"] > 1 else 7
+            if any("failing" in url for url in job["urls"]):
+                status = 10
+            self.respond(200, {"jobs": [{"name": params["name"][0], "jobStatus": {"status": status}}]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestDiffbotBulkExtractor(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDiffbot)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:{}/".format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def extract(self, collection, urls, batch_size):
+        store = DocumentStore(collection, batch_size=10)
+        extractor = DiffbotBulkExtractor("token", store, batch_size=batch_size, poll_interval=0.01, job_timeout=10)
+
+        async def main():
+            results = [await job for job in extractor.jobs((compute_id(url), url) for url in urls)]
+            await store.close()
+            return results
+
+        loop = asyncio.new_event_loop()
+        try:
+            with patch.object(DiffbotClient, "base_url", self.base_url):
+                return loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+    def test_extracts_urls_in_bulk_jobs(self):
+        collection = mongomock.MongoClient()["test"]["documents"]
+        urls = [f"https://example.com/{i}" for i in range(45)] + ["https://example.com/unprocessable"]
+        results = self.extract(collection, urls, batch_size=20)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(collection.count_documents({}), 45)
+        document = collection.find_one({"_id": compute_id("https://example.com/7")})
+        self.assertEqual(document["objects"][0]["title"], "Title of https://example.com/7")
+        self.assertEqual(FakeDiffbot.jobs, {})
+
+    def test_failed_jobs(self):
+        collection = mongomock.MongoClient()["test"]["documents"]
+        urls = ["https://example.com/failing", "https://example.com/lost"]
+        results = self.extract(collection, urls, batch_size=1)
+        self.assertIn("failed: status 10", results[0])
+        self.assertIn("failed: the job is not known to Diffbot", results[1])
+        self.assertEqual(collection.count_documents({}), 0)
+        # Failed jobs are deleted too.
+        self.assertEqual(FakeDiffbot.jobs, {})
+
+
+class TestIterJsonArray(TestCase):
+
+    def test_decodes_elements_split_across_chunks(self):
+        data = json.dumps([{"text": "Grüße " * 10, "number": i} for i in range(20)] + [12345]).encode("utf-8")
+        for chunk_size in (1, 7, len(data)):
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            self.assertEqual(list(iter_json_array(chunks)), json.loads(data))
+        self.assertEqual(list(iter_json_array([b" [ ] "])), [])
+
+    def test_numbers_split_across_chunks(self):
+        self.assertEqual(list(iter_json_array([b"[1.", b"5]"])), [1.5])
+        self.assertEqual(list(iter_json_array([b"[500", b"89.", b"5, 2", b"e3 ", b" ]"])), [50089.5, 2000])
+        self.assertEqual(list(iter_json_array([b"[true", b", {\"a\": 1}", b"]"])), [True, {"a": 1}])
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from src.benchmarks.stub_server import LocalResolver, StubServer
+from src.fetcher import AsyncFetcher, ResponseTooLarge, UnsupportedContentType, sniff_encoding
+
+RESPONSES = {
+    "/page": ("text/html; charset=utf-8", "<html><body><p>Grüße</p></body></html>".encode("utf-8")),
+    "/latin1": ("text/html", '<html><head><meta charset="iso-8859-1"></head><p>Grüße</p></html>'.encode("latin-1")),
+    "/pdf": ("application/pdf", b"%PDF-1.4" + b"0" * 1000),
+    "/large": ("text/html", b"<p>" + b"x" * 10000 + b"</p>"),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path not in RESPONSES:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_type, body = RESPONSES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if self.path == "/large":
+            # No Content-Length, so the size is only known while streaming.
+            self.send_header("Connection", "close")
+            self.end_headers()
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAsyncFetcher(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get(self, path, **kwargs):
+        async def main():
+            async with AsyncFetcher(**kwargs) as fetcher:
+                return await fetcher.get(self.base_url + path)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+    def test_get_html(self):
+        response = self.get("/page")
+        self.assertTrue(response.ok)
+        self.assertEqual(response.encoding, "utf-8")
+        self.assertIn("Grüße", response.text)
+
+    def test_sniffs_meta_charset(self):
+        self.assertIn("Grüße", self.get("/latin1").text)
+
+    def test_error_body_is_not_downloaded(self):
+        response = self.get("/missing")
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.body, b"")
+
+    def test_aborts_on_unsupported_content_type(self):
+        with self.assertRaises(UnsupportedContentType):
+            self.get("/pdf")
+
+    def test_aborts_on_too_large_body(self):
+        with self.assertRaises(ResponseTooLarge):
+            self.get("/large", max_body_size=1000)
+        with self.assertRaises(ResponseTooLarge):
+            self.get("/page", max_body_size=10)
+
+    def test_resolver(self):
+        async def main(port):
+            async with AsyncFetcher(resolver=LocalResolver()) as fetcher:
+                fixture = await fetcher.get(f"http://arxiv.org:{port}/fixture/arxiv/1")
+                return fixture, await fetcher.get(f"http://arxiv.org:{port}/page/2?status=503")
+
+        loop = asyncio.new_event_loop()
+        try:
+            with StubServer() as server:
+                fixture, error = loop.run_until_complete(main(server.port))
+        finally:
+            loop.close()
+        self.assertTrue(fixture.ok)
+        self.assertIn("1807.08518", fixture.text)
+        self.assertEqual(error.status, 503)
+
+
+class TestSniffEncoding(TestCase):
+
+    def test_sniff_encoding(self):
+        self.assertEqual(sniff_encoding(b"\xef\xbb\xbf<html>", "text/html; charset=iso-8859-1"), "utf-8-sig")
+        self.assertEqual(sniff_encoding(b"<html>", 'text/html; charset="Shift_JIS"'), "shift_jis")
+        self.assertEqual(sniff_encoding(b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">'),
+                         "cp1252")
+        self.assertEqual(sniff_encoding(b"<html>", "text/html; charset=unknown"), "utf-8")
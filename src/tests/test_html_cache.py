@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from src.html_cache import HtmlCache, worker_cache_directories
+
+
+class TestHtmlCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        cache = HtmlCache(self.directory.name)
+        cache.put("a", "http://a.com", "<p>Grüße</p>".encode("utf-8"), "utf-8",
+                  {"etag": '"v1"', "Last-Modified": "Mon, 03 Feb 2020 10:00:00 GMT"})
+        page = cache.get("a")
+        self.assertEqual(page.url, "http://a.com")
+        self.assertEqual(page.text, "<p>Grüße</p>")
+        self.assertEqual(cache.validators("a"), ('"v1"', "Mon, 03 Feb 2020 10:00:00 GMT"))
+        self.assertIsNone(cache.get("b"))
+        cache.close()
+
+    def test_reopen(self):
+        cache = HtmlCache(self.directory.name)
+        cache.put("a", "http://a.com", b"<p>first</p>")
+        cache.put("a", "http://a.com", b"<p>second</p>")
+        cache.put("b", "http://b.com", b"<p>b</p>")
+        cache.close()
+        cache = HtmlCache(self.directory.name)
+        self.assertEqual(sorted(cache.ids()), ["a", "b"])
+        self.assertEqual(cache.get("a").body, b"<p>second</p>")
+        cache.put("c", "http://c.com", b"<p>c</p>")
+        self.assertEqual(cache.get("c").body, b"<p>c</p>")
+        cache.close()
+
+    def test_evicts_least_recently_used_segment(self):
+        cache = HtmlCache(self.directory.name, max_size=3000, segment_size=1000)
+        bodies = {str(i): os.urandom(900) for i in range(4)}
+        for id, body in bodies.items():
+            cache.put(id, "http://a.com/" + id, body)
+            if id == "1":
+                cache.get("0")
+        self.assertLessEqual(cache.size, 3000)
+        self.assertIn("0", cache)
+        self.assertNotIn("1", cache)
+        self.assertEqual(cache.get("3").body, bodies["3"])
+        cache.close()
+        self.assertNotIn("1", HtmlCache(self.directory.name))
+
+    def test_worker_cache_directories(self):
+        HtmlCache(self.directory.name).close()
+        for worker_id in ("host-1", "host-0"):
+            HtmlCache(os.path.join(self.directory.name, worker_id)).close()
+        os.makedirs(os.path.join(self.directory.name, "other"))
+        self.assertEqual(worker_cache_directories(self.directory.name),
+                         [os.path.join(self.directory.name, "host-0"), os.path.join(self.directory.name, "host-1")])
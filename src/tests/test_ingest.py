@@ -0,0 +1,109 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from unittest import TestCase
+
+from src.ingest import UrlSource, interleave_by_host, new_urls, prefetch
+from src.url_id import SeenSet, compute_id, url_digest
+
+
+class FakeStore(object):
+    def __init__(self, ids):
+        self.ids = set(ids)
+        self.num_lookups = 0
+
+    def find_existing_ids(self, ids):
+        self.num_lookups += 1
+        return self.ids.intersection(ids)
+
+
+class TestUrlSource(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reads_csv(self):
+        path = os.path.join(self.directory.name, "urls.csv")
+        with open(path, "w") as output:
+            output.write("title,url\na,http://a.com/1\nb,http://b.com/1\nc,\n")
+        source = UrlSource(path, "url")
+        self.assertEqual(list(source), ["http://a.com/1", "http://b.com/1"])
+        self.assertEqual(source.bytes_read, source.total_bytes)
+
+    def test_reads_gzipped_json_lines(self):
+        path = os.path.join(self.directory.name, "urls.jsonl.gz")
+        with gzip.open(path, "wt") as output:
+            for i in range(3):
+                output.write(json.dumps({"link": f"http://a.com/{i}"}) + "\n")
+        source = UrlSource(path, "link")
+        self.assertEqual(list(source), ["http://a.com/0", "http://a.com/1", "http://a.com/2"])
+        self.assertEqual(source.bytes_read, source.total_bytes)
+
+
+class TestNewUrls(TestCase):
+
+    def test_skips_stored_and_duplicate_urls(self):
+        store = FakeStore([compute_id("http://a.com/stored")])
+        urls = ["http://a.com/1", "http://a.com/stored", "http://a.com/1", "http://a.com/2"]
+        self.assertEqual(list(new_urls(urls, store, batch_size=2)),
+                         [(compute_id("http://a.com/1"), "http://a.com/1"),
+                          (compute_id("http://a.com/2"), "http://a.com/2")])
+        self.assertEqual(store.num_lookups, 2)
+
+    def test_known_ids_skip_lookups(self):
+        known = SeenSet()
+        known.add(url_digest("http://a.com/1"))
+        store = FakeStore([])
+        self.assertEqual(list(new_urls(["http://a.com/1"], store, known=known)), [])
+        self.assertEqual(store.num_lookups, 0)
+        self.assertEqual([url for _, url in new_urls(["http://a.com/1", "http://a.com/2"], None, known=known)],
+                         ["http://a.com/2"])
+
+
+class TestInterleaveByHost(TestCase):
+
+    def test_keeps_all_urls(self):
+        urls = [f"http://host{i % 7}.com/{i}" for i in range(100)]
+        self.assertEqual(Counter(interleave_by_host(urls, buffer_size=10, seed=1)), Counter(urls))
+
+    def test_spreads_hosts(self):
+        urls = [f"http://a.com/{i}" for i in range(5)] + [f"http://b.com/{i}" for i in range(5)]
+        result = list(interleave_by_host(urls, buffer_size=100, seed=1))
+        hosts = [url.split("/")[2] for url in result]
+        self.assertTrue(all(first != second for first, second in zip(hosts, hosts[1:])))
+
+
+class TestPrefetch(TestCase):
+
+    def test_does_not_block_event_loop(self):
+        def slow_urls():
+            for i in range(4):
+                time.sleep(0.05)
+                yield f"http://a.com/{i}"
+
+        async def tick(ticks):
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.005)
+
+        async def main():
+            ticks = []
+            ticker = asyncio.ensure_future(tick(ticks))
+            urls = [url async for url in prefetch(slow_urls(), batch_size=2)]
+            ticker.cancel()
+            return urls, ticks
+
+        loop = asyncio.new_event_loop()
+        try:
+            urls, ticks = loop.run_until_complete(main())
+        finally:
+            loop.close()
+        self.assertEqual(urls, [f"http://a.com/{i}" for i in range(4)])
+        self.assertLess(max(later - earlier for earlier, later in zip(ticks, ticks[1:])), 0.04)
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+import urllib.request
+from unittest import TestCase
+
+from src.benchmarks.stub_server import StubServer
+from src.fetcher import AsyncFetcher
+from src.metrics import Histogram, Metrics, SamplingProfiler
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+        for value in [0.005] * 50 + [0.05] * 40 + [0.5] * 9 + [5.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 0.01)
+        self.assertEqual(histogram.quantile(0.9), 0.1)
+        self.assertEqual(histogram.quantile(0.99), 1.0)
+        self.assertEqual(histogram.quantile(1.0), float("inf"))
+
+    def test_prometheus_format_and_snapshot(self):
+        metrics = Metrics()
+        metrics.inc("failures_total", reason='HTTP "503"')
+        metrics.inc("failures_total", reason='HTTP "503"')
+        metrics.observe("parse_seconds", 0.02, handler="_extract_text_fancy")
+        text = metrics.to_prometheus()
+        self.assertIn('failures_total{reason="HTTP \\"503\\""} 2', text)
+        self.assertIn('parse_seconds_bucket{handler="_extract_text_fancy",le="0.025"} 1', text)
+        self.assertIn('parse_seconds_count{handler="_extract_text_fancy"} 1', text)
+        snapshot = json.loads(json.dumps(metrics.snapshot()))
+        self.assertEqual(snapshot["counters"], [{"name": "failures_total", "labels": {"reason": 'HTTP "503"'},
+                                                 "value": 2}])
+
+    def test_hosts_are_bounded(self):
+        metrics = Metrics(max_hosts=2)
+        self.assertEqual([metrics.host(host) for host in ["a", "b", "c", "a"]], ["a", "b", "other", "a"])
+
+    def test_serve(self):
+        metrics = Metrics()
+        metrics.inc("extracted_total", 3)
+        server = metrics.serve(0)
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+            with urllib.request.urlopen(url) as response:
+                self.assertIn("extracted_total 3", response.read().decode("utf-8"))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_connect_time_and_event_loop_lag(self):
+        metrics = Metrics()
+
+        async def main(base_url):
+            monitor = asyncio.ensure_future(metrics.monitor_event_loop_lag(interval=0.01))
+            async with AsyncFetcher(trace_configs=[metrics.trace_config()]) as fetcher:
+                for _ in range(3):
+                    await fetcher.get(base_url)
+            await asyncio.sleep(0.02)
+            # Blocks the event loop.
+            time.sleep(0.1)
+            await asyncio.sleep(0.02)
+            monitor.cancel()
+
+        with StubServer() as server:
+            run(main(server.base_url))
+        histograms = {h["name"]: h for h in metrics.snapshot()["histograms"]}
+        self.assertEqual(histograms["connect_seconds"]["count"], 1)
+        self.assertGreaterEqual(histograms["event_loop_lag_seconds"]["p99"], 0.05)
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSamplingProfiler(TestCase):
+
+    def test_samples_stacks(self):
+        profiler = SamplingProfiler(interval=0.001).start()
+        busy_loop(0.1)
+        profiler.stop()
+        self.assertIn("busy_loop", profiler.collapsed().splitlines()[0])
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import time
+from typing import Tuple
+from unittest import TestCase
+
+from src.parse_pool import HtmlTooLarge, ParsePool, ParseTimeout, ParseWorkerDied
+
+
+def extract_upper(html: str, url: str) -> Tuple[str, str]:
+    return url, html.upper()
+
+
+def extract_forever(html: str, url: str) -> Tuple[str, str]:
+    time.sleep(60)
+    return "", ""
+
+
+def extract_and_exit(html: str, url: str) -> Tuple[str, str]:
+    os._exit(1)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestParsePool(TestCase):
+
+    def setUp(self):
+        self.pool = ParsePool(max_workers=2, parse_timeout=0.5, max_html_size=100, extract=extract_upper)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_extract_text(self):
+        self.assertEqual(run(self.pool.extract_text("<p>text</p>", "http://example.com")),
+                         ("http://example.com", "<P>TEXT</P>"))
+
+    def test_rejects_too_large_html(self):
+        with self.assertRaises(HtmlTooLarge):
+            run(self.pool.extract_text("x" * 101, "http://example.com"))
+
+    def test_parse_timeout(self):
+        self.pool.extract = extract_forever
+        with self.assertRaises(ParseTimeout):
+            run(self.pool.extract_text("<p>text</p>", "http://example.com"))
+        self.pool.extract = extract_upper
+        self.assertEqual(run(self.pool.extract_text("a", "b")), ("b", "A"))
+
+    def test_worker_died(self):
+        self.pool.extract = extract_and_exit
+        with self.assertRaises(ParseWorkerDied):
+            run(self.pool.extract_text("<p>text</p>", "http://example.com"))
+        self.pool.extract = extract_upper
+        self.assertEqual(run(self.pool.extract_text("a", "b")), ("b", "A"))
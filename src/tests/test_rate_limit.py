@@ -0,0 +1,31 @@
+import asyncio
+import time
+from unittest import TestCase
+
+from src.rate_limit import TokenBucket
+
+
+class TestTokenBucket(TestCase):
+
+    def test_limits_rate_after_burst(self):
+        limiter = TokenBucket(rate=100, capacity=5)
+
+        async def main():
+            start = time.monotonic()
+            await asyncio.gather(*[limiter.acquire() for _ in range(25)])
+            return time.monotonic() - start
+
+        loop = asyncio.new_event_loop()
+        try:
+            elapsed = loop.run_until_complete(main())
+        finally:
+            loop.close()
+        # The first 5 calls use the burst capacity, the other 20 are spaced 10 ms apart.
+        self.assertGreaterEqual(elapsed, 0.18)
+        self.assertLess(elapsed, 1.0)
+
+    def test_reserve(self):
+        limiter = TokenBucket(rate=10, capacity=1)
+        self.assertEqual(limiter.reserve(), 0.0)
+        self.assertAlmostEqual(limiter.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(limiter.reserve(), 0.2, delta=0.01)
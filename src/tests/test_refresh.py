@@ -0,0 +1,153 @@
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase, skipIf
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from src.benchmarks.stub_server import LocalResolver, StubServer
+from src.fetcher import AsyncFetcher
+from src.html_cache import HtmlCache
+from src.main import extract_async_text, reextract_async_text
+from src.parse_pool import ParsePool
+from src.refresh import RefreshPolicy, conditional_headers, validators
+from src.store import DocumentStore
+
+DAY = 24 * 3600.0
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestRefreshPolicy(TestCase):
+
+    def test_ttl_for(self):
+        policy = RefreshPolicy(7 * DAY, {"arxiv.org": 30 * DAY})
+        self.assertEqual(policy.ttl_for("https://arxiv.org/abs/1807.08518"), 30 * DAY)
+        self.assertEqual(policy.ttl_for("https://export.arxiv.org/abs/1807.08518"), 30 * DAY)
+        self.assertEqual(policy.ttl_for("https://example.com/?ref=arxiv.org"), 7 * DAY)
+
+    def test_is_due(self):
+        policy = RefreshPolicy(7 * DAY, {"arxiv.org": 30 * DAY})
+        now = datetime.utcnow()
+        self.assertTrue(policy.is_due({"url": "https://a.com/", "text_extracted_at": now - timedelta(days=8)}, now))
+        self.assertFalse(policy.is_due({"url": "https://arxiv.org/", "text_extracted_at": now - timedelta(days=8)},
+                                       now))
+        # A document checked recently is not due, however long ago its text was extracted.
+        self.assertFalse(policy.is_due({"url": "https://a.com/", "text_extracted_at": now - timedelta(days=80),
+                                        "checked_at": now - timedelta(days=1)}, now))
+
+    def test_conditional_headers(self):
+        document = validators({"etag": '"abc"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        self.assertEqual(conditional_headers(document), {"If-None-Match": '"abc"',
+                                                         "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        self.assertEqual(conditional_headers({"url": "https://a.com/"}), {})
+
+    def test_conditional_headers_from_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = HtmlCache(directory)
+            cache.put("a", "https://a.com/", b"<p>a</p>", "utf-8", {"ETag": '"abc"'})
+            self.assertEqual(conditional_headers({"_id": "a", "url": "https://a.com/"}, cache),
+                             {"If-None-Match": '"abc"'})
+            self.assertEqual(conditional_headers({"_id": "a", "etag": '"def"'}, cache), {"If-None-Match": '"def"'})
+            self.assertEqual(conditional_headers({"_id": "b", "url": "https://b.com/"}, cache), {})
+            cache.close()
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestRefresh(TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()["test"]["documents"]
+
+    def test_due(self):
+        now = datetime.utcnow()
+        self.collection.insert_many([
+            {"_id": "a", "url": "https://a.com/", "text_extracted_at": now - timedelta(days=8),
+             "extraction_status_ok": True},
+            {"_id": "b", "url": "https://arxiv.org/", "text_extracted_at": now - timedelta(days=8),
+             "extraction_status_ok": True},
+            {"_id": "c", "url": "https://c.com/", "text_extracted_at": now - timedelta(days=8),
+             "checked_at": now - timedelta(days=1), "extraction_status_ok": True},
+            {"_id": "d", "url": "https://d.com/", "text_extracted_at": now - timedelta(days=8),
+             "extraction_status_ok": False}])
+        due = RefreshPolicy(7 * DAY, {"arxiv.org": 30 * DAY}).due(DocumentStore(self.collection), now)
+        self.assertEqual([(id, url) for id, url, _ in due], [("a", "https://a.com/")])
+
+    def extract(self, url, previous=None, replace=False):
+        async def main():
+            store = DocumentStore(self.collection)
+            async with AsyncFetcher(resolver=LocalResolver()) as fetcher:
+                result = await extract_async_text("a", url, store, fetcher, self.parser, replace=replace,
+                                                  previous=previous)
+            await store.close()
+            return result
+
+        return run(main())
+
+    def test_refresh(self):
+        self.parser = ParsePool(max_workers=1)
+        self.addCleanup(self.parser.shutdown)
+        with StubServer() as server:
+            url = f"http://arxiv.org:{server.port}/fixture/arxiv/1"
+            self.extract(url)
+            stored = self.collection.find_one({"_id": "a"})
+            self.assertEqual(stored["title"], "[1807.08518] A study of large systems")
+            self.assertTrue(stored["etag"] and stored["content_hash"] and stored["text_hash"])
+
+            # The stored ETag makes the GET conditional.
+            self.assertIn("not modified", self.extract(url, dict(stored), replace=True))
+            # Without it, the page is fetched, but not parsed again since its content hash is the same.
+            without_etag = {name: value for name, value in stored.items() if name != "etag"}
+            self.assertIn("Content of url", self.extract(url, without_etag, replace=True))
+            refreshed = self.collection.find_one({"_id": "a"})
+            self.assertEqual(refreshed["text_extracted_at"], stored["text_extracted_at"])
+            self.assertGreater(refreshed["checked_at"], stored["text_extracted_at"])
+
+            # A page that changed, e.g., in its ads, but not in its text, is not rewritten either.
+            self.assertIn("Text of url", self.extract(url, dict(without_etag, content_hash=""), replace=True))
+            self.assertEqual(self.collection.find_one({"_id": "a"})["text_extracted_at"], stored["text_extracted_at"])
+
+            # A page whose text changed is rewritten.
+            changed = dict(without_etag, content_hash="", text_hash="")
+            self.assertIn("Extracted text", self.extract(url, changed, replace=True))
+            rewritten = self.collection.find_one({"_id": "a"})
+            self.assertGreater(rewritten["text_extracted_at"], stored["text_extracted_at"])
+            self.assertNotIn("checked_at", rewritten)
+
+            # A document stored before text hashes were kept is compared with its stored text, and gets the hash.
+            self.collection.update_one({"_id": "a"}, {"$unset": {"text_hash": ""}})
+            legacy = {name: value for name, value in changed.items() if name != "text_hash"}
+            self.assertIn("Text of url", self.extract(url, legacy, replace=True))
+            self.assertEqual(self.collection.find_one({"_id": "a"})["text_hash"], stored["text_hash"])
+
+    def test_reextract_keeps_validators_and_hashes(self):
+        self.parser = ParsePool(max_workers=1)
+        self.addCleanup(self.parser.shutdown)
+        with StubServer() as server, tempfile.TemporaryDirectory() as directory:
+            url = f"http://arxiv.org:{server.port}/fixture/arxiv/1"
+            cache = HtmlCache(directory)
+            self.addCleanup(cache.close)
+
+            async def main():
+                store = DocumentStore(self.collection)
+                async with AsyncFetcher(resolver=LocalResolver()) as fetcher:
+                    await extract_async_text("a", url, store, fetcher, self.parser, cache)
+                    await store.flush()
+                    self.fetched = self.collection.find_one({"_id": "a"})
+                    await reextract_async_text("a", store, self.parser, cache)
+                await store.close()
+
+            run(main())
+            reextracted = self.collection.find_one({"_id": "a"})
+            for name in ("etag", "content_hash", "text_hash"):
+                self.assertEqual(reextracted[name], self.fetched[name])
+            self.assertLessEqual(reextracted["checked_at"], reextracted["text_extracted_at"])
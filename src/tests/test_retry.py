@@ -0,0 +1,172 @@
+import asyncio
+import time
+from email.utils import formatdate
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+import requests
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from src.fetcher import AsyncFetcher
+from src.main import extract_async_text
+from src.parse_pool import ParsePool
+from src.retry import CircuitBreaker, Retrier, RetryPolicy, parse_retry_after
+from src.scheduler import BoundedScheduler
+from src.store import DocumentStore
+from src.third_party.diffbot import DiffbotClient
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestRetryPolicy(TestCase):
+
+    def test_delay_is_jittered_and_capped(self):
+        policy = RetryPolicy(max_retries=10, base_delay=1.0, max_delay=5.0)
+        for attempt in range(10):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, min(5.0, 2 ** attempt))
+        self.assertIsNone(policy.delay(10))
+
+    def test_honours_retry_after(self):
+        policy = RetryPolicy(max_retries=3, base_delay=0.001, max_delay=60.0)
+        self.assertGreaterEqual(policy.delay(0, retry_after=30.0), 30.0)
+        self.assertIsNone(policy.delay(0, retry_after=3600.0))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 60, usegmt=True)), 60.0, delta=2.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class TestCircuitBreaker(TestCase):
+
+    def test_opens_after_threshold_and_backs_off(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+        self.assertEqual(breaker.record_failure("a"), 0.0)
+        self.assertEqual(breaker.record_failure("a"), 0.0)
+        self.assertEqual(breaker.record_failure("a"), 10.0)
+        self.assertTrue(breaker.is_open("a"))
+        self.assertFalse(breaker.is_open("b"))
+        # Failures of requests already in flight when the circuit opened are not counted.
+        self.assertEqual(breaker.record_failure("a"), 0.0)
+
+        breaker._open_until["a"] = 0.0
+        self.assertEqual(breaker.record_failure("a"), 20.0)
+        breaker.record_success("a")
+        self.assertFalse(breaker.is_open("a"))
+        self.assertEqual(breaker.record_failure("a"), 0.0)
+
+
+class TestRetrier(TestCase):
+
+    def test_retries_until_success_and_gives_up(self):
+        scheduler = BoundedScheduler(limit=10, per_key_limit=2)
+        retrier = Retrier(scheduler, RetryPolicy(max_retries=2, base_delay=0.001),
+                          CircuitBreaker(failure_threshold=100))
+        attempts = {"flaky": 0, "down": 0}
+
+        async def fetch(host, attempt=0):
+            attempts[host] += 1
+            if host == "flaky" and attempt == 1:
+                retrier.record_success(host)
+                return "ok"
+            delay = retrier.retry(host, attempt, lambda: fetch(host, attempt + 1))
+            return "retrying" if delay is not None else "failed"
+
+        async def main():
+            jobs = ((host, fetch(host)) for host in ["flaky", "down"])
+            return sorted([await task async for task in scheduler.as_completed(jobs)])
+
+        self.assertEqual(run(main()), ["failed", "ok", "retrying", "retrying", "retrying"])
+        self.assertEqual(attempts, {"flaky": 2, "down": 3})
+        self.assertEqual(retrier.num_retries, 3)
+
+    def test_open_circuit_pauses_host(self):
+        scheduler = BoundedScheduler(limit=10)
+        retrier = Retrier(scheduler, RetryPolicy(max_retries=0), CircuitBreaker(failure_threshold=1,
+                                                                                 reset_timeout=0.05))
+        starts = []
+
+        async def fetch(host, attempt=0):
+            starts.append((host, time.monotonic()))
+            if host == "down" and attempt == 0:
+                retrier.retry(host, attempt, lambda: fetch(host, attempt + 1))
+                scheduler.submit(fetch(host, attempt + 1), host)
+
+        async def main():
+            jobs = ((host, fetch(host)) for host in ["down", "up"])
+            async for task in scheduler.as_completed(jobs):
+                await task
+
+        run(main())
+        self.assertEqual(retrier.num_pauses, 1)
+        self.assertEqual([host for host, _ in starts], ["down", "up", "down"])
+        self.assertGreaterEqual(starts[2][1] - starts[0][1], 0.04)
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestExtractRetries(TestCase):
+
+    def test_invalid_urls_are_not_retried(self):
+        collection = mongomock.MongoClient()["test"]["documents"]
+        retrier = Retrier(BoundedScheduler(limit=10), RetryPolicy(max_retries=3, base_delay=0.001),
+                          CircuitBreaker(failure_threshold=1))
+        parser = ParsePool(max_workers=1)
+        self.addCleanup(parser.shutdown)
+
+        async def main():
+            store = DocumentStore(collection)
+            async with AsyncFetcher() as fetcher:
+                for id, url in [("a", "http://"), ("b", "ftp://example.com/file")]:
+                    await extract_async_text(id, url, store, fetcher, parser, retrier=retrier)
+            await store.close()
+
+        run(main())
+        self.assertEqual(retrier.num_retries, 0)
+        self.assertEqual(retrier.num_pauses, 0)
+        self.assertEqual(collection.find_one({"_id": "a"})["extraction_fail_reason"], "Invalid url")
+        self.assertIn(collection.find_one({"_id": "b"})["extraction_fail_reason"], ("Invalid url", "Client error"))
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+    def json(self):
+        return {"objects": []}
+
+
+class TestDiffbotClientRetries(TestCase):
+
+    def test_request_is_retried(self):
+        client = DiffbotClient()
+        client.retry_policy = RetryPolicy(max_retries=3, base_delay=0.001)
+        responses = [requests.ConnectionError(), FakeResponse(503, {"Retry-After": "0"}), FakeResponse(200)]
+
+        def request(method, url, **kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with patch("src.third_party.diffbot.requests.request", side_effect=request):
+            self.assertEqual(client.request("https://example.com/", "token", "analyze"), {"objects": []})
+        self.assertEqual(responses, [])
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from unittest import TestCase
+
+from src.scheduler import BoundedScheduler
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestBoundedScheduler(TestCase):
+
+    def test_runs_all_jobs_within_limit(self):
+        scheduler = BoundedScheduler(limit=5)
+        state = {"running": 0, "max_running": 0}
+
+        async def job(i):
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+            await asyncio.sleep(0.001)
+            state["running"] -= 1
+            return i
+
+        async def main():
+            return [await task async for task in scheduler.as_completed(job(i) for i in range(50))]
+
+        results = run(main())
+        self.assertEqual(sorted(results), list(range(50)))
+        self.assertEqual(state["max_running"], 5)
+        self.assertEqual(scheduler.in_flight, 0)
+        self.assertEqual(scheduler.queued, 0)
+
+    def test_reads_input_lazily(self):
+        consumed = []
+
+        def jobs():
+            for i in range(100):
+                consumed.append(i)
+                yield asyncio.sleep(0, result=i)
+
+        async def main():
+            async for task in BoundedScheduler(limit=3, max_queued=0).as_completed(jobs()):
+                await task
+                break
+
+        run(main())
+        self.assertLessEqual(len(consumed), 4)
+
+    def test_per_key_limit(self):
+        scheduler = BoundedScheduler(limit=10, per_key_limit=2)
+        running = {}
+        max_running = {}
+
+        async def job(key):
+            running[key] = running.get(key, 0) + 1
+            max_running[key] = max(max_running.get(key, 0), running[key])
+            await asyncio.sleep(0.001)
+            running[key] -= 1
+
+        async def main():
+            jobs = ((key, job(key)) for key in ["a", "b", "a", "a", "a", "b", "c", "a"])
+            async for task in scheduler.as_completed(jobs):
+                await task
+
+        run(main())
+        self.assertEqual(max_running, {"a": 2, "b": 2, "c": 1})
+
+    def test_politeness_delay(self):
+        starts = []
+
+        async def job():
+            starts.append(time.monotonic())
+
+        async def main():
+            jobs = (("host", job()) for _ in range(3))
+            async for task in BoundedScheduler(limit=10, politeness_delay=0.02).as_completed(jobs):
+                await task
+
+        run(main())
+        self.assertEqual(len(starts), 3)
+        for earlier, later in zip(starts, starts[1:]):
+            self.assertGreaterEqual(later - earlier, 0.015)
+
+    def test_submit_reschedules_job(self):
+        scheduler = BoundedScheduler(limit=2)
+        attempts = []
+
+        async def job(attempt):
+            attempts.append(attempt)
+            if attempt < 2:
+                scheduler.submit(job(attempt + 1), delay=0.001)
+            return attempt
+
+        async def main():
+            return [await task async for task in scheduler.as_completed([job(0)])]
+
+        self.assertEqual(run(main()), [0, 1, 2])
+        self.assertEqual(attempts, [0, 1, 2])
+
+    def test_exceptions_are_raised_when_awaiting_task(self):
+        async def failing():
+            raise ValueError("boom")
+
+        async def main():
+            async for task in BoundedScheduler(limit=2).as_completed([failing()]):
+                with self.assertRaises(ValueError):
+                    await task
+
+        run(main())
+
+    def test_async_input(self):
+        scheduler = BoundedScheduler(limit=3)
+
+        async def jobs():
+            for i in range(20):
+                # The input is slower than the jobs at times, and the scheduler waits for it.
+                await asyncio.sleep(0.001 if i % 5 == 0 else 0)
+                yield str(i % 2), asyncio.sleep(0, result=i)
+
+        async def main():
+            return [await task async for task in scheduler.as_completed(jobs())]
+
+        self.assertEqual(sorted(run(main())), list(range(20)))
+        self.assertEqual(scheduler.queued, 0)
@@ -0,0 +1,146 @@
+import asyncio
+from unittest import TestCase, skipIf
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from src.store import DocumentStore, operation_id
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FailingCollection(object):
+    """ Fails to write documents with a `fail` field, as MongoDb does, e.g., with documents that fail validation. """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def bulk_write(self, operations, ordered=True):
+        failed = [i for i, operation in enumerate(operations) if operation._doc.get("fail")]
+        self.collection.bulk_write([operation for i, operation in enumerate(operations) if i not in failed],
+                                   ordered=ordered)
+        if failed:
+            raise BulkWriteError({"nInserted": len(operations) - len(failed),
+                                  "writeErrors": [{"index": i, "code": 121, "errmsg": "Document failed validation"}
+                                                  for i in failed]})
+
+
+class FlakyCollection(object):
+    """ Fails the first `failures` bulk writes, as when the primary of a replica set steps down. """
+
+    def __init__(self, collection, failures=1):
+        self.collection = collection
+        self.failures = failures
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection closed")
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestDocumentStore(TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()["test"]["documents"]
+        self.collection.insert_many([{"_id": "a"}, {"_id": "b"}])
+
+    def test_find_existing_ids(self):
+        store = DocumentStore(self.collection, lookup_batch_size=1)
+        self.assertEqual(store.find_existing_ids(["a", "b", "c"]), {"a", "b"})
+        self.assertEqual(store.load_ids(), {"a", "b"})
+
+    def test_writes_are_buffered_until_batch_is_full(self):
+        store = DocumentStore(self.collection, batch_size=2, flush_interval=60)
+
+        async def main():
+            await store.insert({"_id": "c"})
+            self.assertEqual(self.collection.count_documents({}), 2)
+            await store.insert({"_id": "d"})
+            self.assertEqual(self.collection.count_documents({}), 4)
+            await store.close()
+
+        run(main())
+
+    def test_close_flushes_and_ignores_duplicates(self):
+        store = DocumentStore(self.collection, batch_size=100, flush_interval=60)
+
+        async def main():
+            await store.insert({"_id": "a"})
+            await store.insert({"_id": "c"})
+            await store.close()
+
+        run(main())
+        self.assertEqual(store.load_ids(), {"a", "b", "c"})
+
+    def test_find_failed(self):
+        self.collection.insert_many([
+            {"_id": "c", "url": "https://c.com/", "extraction_status_ok": False, "extraction_fail_reason": "Timeout"},
+            {"_id": "d", "url": "https://d.com/", "extraction_status_ok": False, "extraction_fail_reason": "SSL error"},
+            {"_id": "e", "url": "https://e.com/", "extraction_status_ok": True}])
+        # One document per page.
+        store = DocumentStore(self.collection, lookup_batch_size=1)
+        self.assertEqual(list(store.find_failed()), [("c", "https://c.com/"), ("d", "https://d.com/")])
+        self.assertEqual(list(store.find_failed(["Timeout"])), [("c", "https://c.com/")])
+        self.assertEqual(store.count_failure_reasons(), {"Timeout": 1, "SSL error": 1})
+
+    def test_on_written_gets_only_written_operations(self):
+        written = []
+        store = DocumentStore(FailingCollection(self.collection), batch_size=100, flush_interval=60,
+                              on_written=lambda operations: written.extend(map(operation_id, operations)))
+
+        async def main():
+            await store.insert({"_id": "c"})
+            await store.insert({"_id": "d", "fail": True})
+            await store.insert({"_id": "e"})
+            await store.close()
+
+        run(main())
+        self.assertEqual(written, ["c", "e"])
+        self.assertEqual(DocumentStore(self.collection).load_ids(), {"a", "b", "c", "e"})
+
+    def test_failed_flush_is_written_later(self):
+        store = DocumentStore(FlakyCollection(self.collection), batch_size=2, flush_interval=0.01)
+
+        async def main():
+            await store.insert({"_id": "c"})
+            await store.insert({"_id": "d"})
+            # The batch failed, and is kept for the next flush, by the flusher that is still running.
+            self.assertEqual(self.collection.count_documents({}), 2)
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.collection.count_documents({}), 4)
+            await store.insert({"_id": "e"})
+            await store.close()
+
+        run(main())
+        self.assertEqual(DocumentStore(self.collection).load_ids(), {"a", "b", "c", "d", "e"})
+
+    def test_close_retries_failed_flush(self):
+        store = DocumentStore(FlakyCollection(self.collection, failures=2), batch_size=100, flush_interval=0.01)
+
+        async def main():
+            await store.insert({"_id": "c"})
+            await store.close(attempts=3)
+
+        run(main())
+        self.assertEqual(DocumentStore(self.collection).load_ids(), {"a", "b", "c"})
+
+        store = DocumentStore(FlakyCollection(self.collection, failures=2), batch_size=100, flush_interval=0.01)
+
+        async def fail():
+            await store.insert({"_id": "d"})
+            await store.close(attempts=2)
+
+        with self.assertRaises(AutoReconnect):
+            run(fail())
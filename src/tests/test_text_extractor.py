@@ -1,37 +1,51 @@
 from unittest import TestCase
-from bs4 import BeautifulSoup
+
+from src.benchmarks.bench_extract import FIXTURE_URLS, load_fixture
+from src.benchmarks.stub_server import StubServer
 from src.text_extractor import TextExtractor
-import requests
-from pprint import pprint
 
 
 class TestExtractText(TestCase):
 
     def test_extract_text(self):
-        url = "https://www.kaggle.com/jhoward/nb-svm-strong-linear-baseline/"
-        response = requests.get(url, allow_redirects=True, headers=TextExtractor.USER_AGENT)
-        title, text = TextExtractor.extract_text(response.text, url)
-        print(f"title: {title}")
-        print(f"text:  {text}")
+        title, text = TextExtractor.extract_text(load_fixture("generic"), FIXTURE_URLS["generic"])
+        self.assertEqual(title, "How large systems behave | Example News")
+        self.assertTrue(text)
 
     def test_extract_text_newspaper(self):
-        url = "https://arxiv.org/abs/1807.08518"
-        response = requests.get(url, allow_redirects=True, headers=TextExtractor.USER_AGENT)
-        content = BeautifulSoup(response.text, "lxml")
-        title, text = TextExtractor._extract_text_fancy(response.text, content)
-        print(f"title: {title}")
-        print(f"text:  {text}")
+        # Newspaper3k finds no article on the arxiv page, so the basic technique is used instead, on a tree that
+        # Newspaper3k has not cleaned.
+        content = TextExtractor.parse(load_fixture("arxiv"))
+        title, text = TextExtractor._extract_text_fancy(content)
+        self.assertEqual(title, "[1807.08518] A study of large systems")
+        self.assertEqual(text, TextExtractor._extract_text_default(TextExtractor.parse(load_fixture("arxiv")))[1])
+
+    def test_missing_markup(self):
+        # Pages without the markup a handler looks for give an empty title or text rather than an error.
+        html = "<html><body><p>Front page</p></body></html>"
+        self.assertEqual(TextExtractor.extract_text(html, "https://www.quantamagazine.org/"), ("", ""))
+        self.assertEqual(TextExtractor.extract_text(html, "https://medium.com/some-post")[0], "")
 
     def test_extract_text_arxiv(self):
-        url = "https://arxiv.org/abs/1807.08518"
-        content = TextExtractor.get_content(url)
+        with StubServer() as server:
+            content = TextExtractor.get_content(f"{server.base_url}/fixture/arxiv")
         title, text = TextExtractor._extract_text_arxiv(content)
-        print(f"title: {title}")
-        print(f"text:  {text}")
+        self.assertEqual(title, "[1807.08518] A study of large systems")
+        self.assertTrue(text.startswith("Abstract:"))
 
     def test_extract_text_instagram(self):
-        url = "https://www.instagram.com/p/BfWL3G_BFTM/?hl=en&taken-by=ptr_yeung"
-        response = requests.get(url, allow_redirects=True, headers=TextExtractor.USER_AGENT)
-        title, text = TextExtractor.extract_text(response.text, url)
-        print(f"title: {title}")
-        print(f"text: {text}")
+        title, text = TextExtractor.extract_text(load_fixture("instagram"), FIXTURE_URLS["instagram"])
+        self.assertEqual(title, "Peter Yeung on Instagram")
+        self.assertEqual(text, "Sunset over the harbour, taken on the evening ferry.")
+
+    def test_extract_text_medium(self):
+        title, _ = TextExtractor.extract_text(load_fixture("medium"), FIXTURE_URLS["medium"])
+        self.assertEqual(title, "Train the robotic arm to reach a ball – Towards Data Science")
+
+    def test_handler_for(self):
+        self.assertEqual(TextExtractor.handler_for("https://arxiv.org/abs/1807.08518"),
+                         TextExtractor._extract_text_arxiv)
+        self.assertEqual(TextExtractor.handler_for("https://blog.medium.com/some-post"),
+                         TextExtractor._extract_text_medium)
+        self.assertEqual(TextExtractor.handler_for("https://example.com/?ref=twitter.com"),
+                         TextExtractor._extract_text_fancy)
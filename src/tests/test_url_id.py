@@ -0,0 +1,77 @@
+import hashlib
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from src.url_id import BloomFilter, SeenSet, compute_id, open_known_ids, url_digest
+
+
+def random_digests(n, seed=0):
+    rng = random.Random(seed)
+    return [bytes(rng.getrandbits(8) for _ in range(16)) for _ in range(n)]
+
+
+class TestUrlId(TestCase):
+
+    def test_compute_id_is_hex_of_digest(self):
+        url = "http://example.com/a?b=1&a=2"
+        self.assertEqual(compute_id(url), url_digest(url).hex())
+        self.assertEqual(len(compute_id(url)), 32)
+        self.assertEqual(compute_id("http://example.com/"), hashlib.md5(b"http://example.com/").hexdigest())
+
+
+class TestSeenSet(TestCase):
+
+    def test_membership_across_runs(self):
+        digests = random_digests(1000)
+        seen = SeenSet(buffer_size=64)
+        seen.update(digests)
+        seen.update(digests[:100])
+        self.assertTrue(all(d in seen for d in digests))
+        self.assertFalse(any(d in seen for d in random_digests(100, seed=1)))
+        self.assertEqual(len(seen), 1000)
+        self.assertEqual(list(seen), sorted(digests))
+
+    def test_save_and_load(self):
+        digests = random_digests(500)
+        seen = SeenSet(buffer_size=64)
+        seen.update(digests)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "known.idx")
+            seen.save(path)
+            self.assertEqual(os.path.getsize(path), 500 * 16)
+            loaded = SeenSet.load(path)
+            self.assertTrue(all(d in loaded for d in digests))
+            loaded.close()
+
+
+class TestBloomFilter(TestCase):
+
+    def test_membership_and_persistence(self):
+        digests = random_digests(1000)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "known.bloom")
+            bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+            bloom.update(digests)
+            bloom.save()
+            bloom.close()
+            bloom = BloomFilter(path)
+            self.assertTrue(all(d in bloom for d in digests))
+            false_positives = sum(d in bloom for d in random_digests(1000, seed=1))
+            self.assertLess(false_positives, 50)
+            bloom.close()
+
+    def test_refuses_full_filter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "known.bloom")
+            bloom = open_known_ids(path, capacity=100)
+            bloom.update(random_digests(100))
+            self.assertEqual(bloom.count, 100)
+            self.assertFalse(bloom.is_full)
+            bloom.update(random_digests(10, seed=1))
+            self.assertTrue(bloom.is_full)
+            bloom.save()
+            bloom.close()
+            with self.assertRaises(ValueError):
+                open_known_ids(path)
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest import TestCase, skipIf
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from pymongo import InsertOne
+
+from src.ingest import prefetch
+from src.store import DocumentStore
+from src.url_id import compute_id
+from src.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+URLS = [f"https://example.com/{i}" for i in range(50)]
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestWorkQueue(TestCase):
+
+    def setUp(self):
+        self.database = mongomock.MongoClient()["test"]
+        self.queue = WorkQueue(self.database["queue"], "worker-1", lease_timeout=60, max_attempts=2)
+        self.queue.enqueue((compute_id(url), url) for url in URLS)
+
+    def test_enqueue_is_idempotent(self):
+        self.queue.lease(10)
+        self.queue.enqueue((compute_id(url), url) for url in URLS)
+        self.assertEqual(self.queue.counts(), {PENDING: 40, LEASED: 10})
+
+    def test_workers_lease_distinct_urls(self):
+        other = WorkQueue(self.database["queue"], "worker-2")
+        first = self.queue.lease(30)
+        second = other.lease(30)
+        self.assertEqual(len(first), 30)
+        self.assertEqual(len(second), 20)
+        self.assertEqual({url for _, url in first + second}, set(URLS))
+        self.assertEqual(other.lease(30), [])
+
+    def test_expired_leases_are_reclaimed(self):
+        leased = self.queue.lease(50)
+        self.database["queue"].update_many({}, {"$set": {"leased_until": datetime.utcnow() - timedelta(seconds=1)}})
+        other = WorkQueue(self.database["queue"], "worker-2")
+        self.assertEqual(sorted(other.lease(100)), sorted(leased))
+        # Leased a second time by now, so the urls fail once that lease runs out too.
+        self.database["queue"].update_many({}, {"$set": {"leased_until": datetime.utcnow() - timedelta(seconds=1)}})
+        self.queue.reclaim()
+        self.assertEqual(self.queue.counts(), {FAILED: 50})
+
+    def test_restarted_worker_releases_its_leases(self):
+        self.queue.lease(10)
+        restarted = WorkQueue(self.database["queue"], "worker-1")
+        self.assertEqual(restarted.release(), 10)
+        self.assertEqual(self.queue.counts(), {PENDING: 50})
+
+    def test_written_documents_are_done(self):
+        leased = list(self.queue.leased_urls(batch_size=7))
+        self.assertEqual(len(leased), 50)
+        store = DocumentStore(self.database["documents"], on_written=self.queue.on_written)
+
+        async def main():
+            for id, url in leased[:20]:
+                await store.write(InsertOne({"_id": id, "url": url}))
+            await store.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        finally:
+            loop.close()
+        self.assertEqual(self.queue.counts(), {DONE: 20, LEASED: 30})
+
+    def test_leases_are_prefetched(self):
+        async def main():
+            leased, counts = [], None
+            async for item in prefetch(self.queue.leased_urls(batch_size=7), 7):
+                if counts is None:
+                    counts = self.queue.counts()
+                leased.append(item)
+            return leased, counts
+
+        loop = asyncio.new_event_loop()
+        try:
+            leased, counts = loop.run_until_complete(main())
+        finally:
+            loop.close()
+        self.assertEqual(len(leased), 50)
+        # The batch being consumed, and at most the next one.
+        self.assertLessEqual(counts[LEASED], 14)
+
+    def test_enqueue_input_resumes_from_checkpoint(self):
+        queue = WorkQueue(self.database["other_queue"], "worker-1")
+
+        def interrupted():
+            yield from URLS[:30]
+            raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            queue.enqueue_input("urls.csv", interrupted(), batch_size=10)
+        self.assertEqual(queue.checkpoints.find_one({"_id": "urls.csv"})["urls_read"], 30)
+
+        def urls():
+            for i, url in enumerate(URLS):
+                if i >= 30:
+                    read.append(url)
+                yield url
+
+        read = []
+        self.assertEqual(queue.enqueue_input("urls.csv", urls(), batch_size=10), 50)
+        self.assertEqual(read, URLS[30:])
+        self.assertEqual(queue.counts(), {PENDING: 50})
+
+        # The enqueue is done, so a new input with the same name is read from the start.
+        self.assertIsNone(queue.checkpoints.find_one({"_id": "urls.csv"}))
+        other_urls = [f"https://example.org/{i}" for i in range(40)]
+        self.assertEqual(queue.enqueue_input("urls.csv", other_urls, batch_size=10), 40)
+        self.assertEqual(queue.counts(), {PENDING: 90})
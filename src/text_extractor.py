@@ -1,81 +1,176 @@
-from bs4 import BeautifulSoup
-from typing import Tuple
-import newspaper
+import copy
+import re
+from typing import Callable, Dict, Tuple
+from urllib.parse import urlsplit
+
+import lxml.html
+from lxml import etree
+from lxml.html import HtmlElement
+from newspaper.cleaners import DocumentCleaner
+from newspaper.configuration import Configuration
+from newspaper.extractors import ContentExtractor
+from newspaper.outputformatters import OutputFormatter
 import requests
 import json
 
+from src.fetcher import CHUNK_SIZE, MAX_BODY_SIZE, ResponseTooLarge, check_content_type, sniff_encoding
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Selectors are compiled once per process rather than once per document.
+_TITLE = etree.XPath("(//title)[1]")
+_PARAGRAPHS = etree.XPath("//p")
+_FIRST_SCRIPT = etree.XPath("(//script)[1]")
+_JSON_LD = etree.XPath("(//script[@type='application/ld+json'])[1]")
+_ARXIV_ABSTRACT = etree.XPath(f"(//blockquote[{_has_class('abstract')} and {_has_class('mathjax')}])[1]")
+_QUANTA_TITLE = etree.XPath("//*[@id='postBody']/div[1]/section/section/div/"
+                            f"div[{_has_class('post__title')} and {_has_class('pv1')} and {_has_class('scale1')} and "
+                            f"{_has_class('mha')}]/div/h1")
+_QUANTA_SECTIONS = etree.XPath(f"//div[{_has_class('post__content__section')}]")
+_MEDIUM_CONTAINERS = etree.XPath("//*[@id='root']/div/article/div/section/div/div")
+_MEDIUM_TEXT_TAGS = etree.XPath(".//*[self::p or self::h1 or self::h2 or self::h3 or self::h4 or self::h5 or self::h6]")
+
+_XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>", re.IGNORECASE)
+
+
+class _Newspaper(object):
+    # The Newspaper3k objects behind newspaper.fulltext(), created once per process. Unlike fulltext(), they work
+    # on the tree already parsed by TextExtractor instead of parsing the HTML again.
+    _instance = None
+
+    def __init__(self):
+        config = Configuration()
+        config.language = "en"
+        self.extractor = ContentExtractor(config)
+        self.document_cleaner = DocumentCleaner(config)
+        self.output_formatter = OutputFormatter(config)
+
+    @classmethod
+    def get(cls) -> "_Newspaper":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def fulltext(self, content: HtmlElement) -> str:
+        doc = self.document_cleaner.clean(content)
+        top_node = self.extractor.calculate_best_node(doc)
+        top_node = self.extractor.post_cleanup(top_node)
+        text, _ = self.output_formatter.get_formatted(top_node)
+        return text
+
+
+def _text(element: HtmlElement) -> str:
+    return element.text_content().strip()
+
 
 class TextExtractor(object):
     HTTP_HEADERS = {
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36",
         "Accept-Language": "en-US;q=0.8,en;q=0.7"}
 
+    # Site specific handlers, keyed by hostname suffix. See handler_for().
+    HANDLERS: Dict[str, Callable[[HtmlElement], Tuple[str, str]]] = {}
+
     def __init__(self):
         pass
 
     @staticmethod
-    def get_content(url: str) -> BeautifulSoup:
-        response = requests.get(url, allow_redirects=True, headers=TextExtractor.HTTP_HEADERS)
-        response.raise_for_status()
-        content = BeautifulSoup(response.text, "lxml")
-        return content
+    def parse(html: str) -> HtmlElement:
+        """ Parse the HTML document once; all handlers work on the resulting tree. """
+        if isinstance(html, str) and html.lstrip().startswith("<?"):
+            # lxml refuses str input with an encoding declaration.
+            html = _XML_DECLARATION.sub("", html, count=1)
+        return lxml.html.document_fromstring(html)
 
     @staticmethod
-    def _extract_text_default(html: str) -> Tuple[str, str]:
+    def get_content(url: str, max_body_size: int = MAX_BODY_SIZE) -> HtmlElement:
+        with requests.get(url, allow_redirects=True, headers=TextExtractor.HTTP_HEADERS, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type")
+            check_content_type(content_type)
+            body = bytearray()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body += chunk
+                if len(body) > max_body_size:
+                    raise ResponseTooLarge(f"Body of {url} exceeds {max_body_size} bytes")
+        return TextExtractor.parse(bytes(body).decode(sniff_encoding(body, content_type), errors="replace"))
+
+    @classmethod
+    def register(cls, host_suffix: str, handler: Callable[[HtmlElement], Tuple[str, str]]) -> None:
+        """ Use handler for urls whose hostname is host_suffix or a subdomain of it. """
+        cls.HANDLERS[host_suffix] = handler
+
+    @classmethod
+    def handler_for(cls, url: str) -> Callable[[HtmlElement], Tuple[str, str]]:
+        """
+        Returns the handler for the url: the one registered for the longest suffix of the hostname, or the default
+        handler. Costs one dictionary lookup per label of the hostname.
+        """
+        hostname = urlsplit(url).hostname or ""
+        while hostname:
+            handler = cls.HANDLERS.get(hostname)
+            if handler is not None:
+                return handler
+            _, _, hostname = hostname.partition(".")
+        return TextExtractor._extract_text_fancy
+
+    @staticmethod
+    def _extract_title(content: HtmlElement) -> str:
+        titles = _TITLE(content)
+        return _text(titles[0]) if titles else ""
+
+    @staticmethod
+    def _extract_text_default(content: HtmlElement) -> Tuple[str, str]:
         """ Method for extracting the (relevant) plain text content from a HTML document. """
-        try:
-            title = ""
-            text = ""
-            content = BeautifulSoup(html, "lxml")
-            for script in content(["script", "style", "pre", "code", "aside"]):
-                script.extract()
-            select = [e.text.strip() for e in content.select("p")]
-            if content.find("title") is not None:
-                title = content.find("title").text.strip()
-            text = "\n".join(select)
-        except TypeError:
-            print("Could not parse payload: {}".format(html))
-            title = ""
-            text = ""
+        title = TextExtractor._extract_title(content)
+        etree.strip_elements(content, "script", "style", "pre", "code", "aside", with_tail=False)
+        text = "\n".join(_text(p) for p in _PARAGRAPHS(content))
         return title, text
 
     @staticmethod
-    def _extract_text_fancy(html: str, content: BeautifulSoup) -> Tuple[str, str]:
-        title = text = ""
-        text = newspaper.fulltext(html)
-        if content.find("title") is not None:
-            title = content.find("title").text.strip()
+    def _extract_text_fancy(content: HtmlElement) -> Tuple[str, str]:
+        title = TextExtractor._extract_title(content)
+        try:
+            # Newspaper3k cleans the tree in place, e.g., turning divs into paragraphs, so it gets a copy, as in its
+            # own Article.parse(). The document is still parsed only once.
+            text = _Newspaper.get().fulltext(copy.deepcopy(content))
+        except AttributeError:
+            # Newspaper3k found no content node.
+            print("Could not extract title and text using Newspaper3k, resorting to basic tech")
+            _, text = TextExtractor._extract_text_default(content)
         return title, text
 
     @staticmethod
-    def _extract_text_arxiv(content: BeautifulSoup) -> Tuple[str, str]:
-        title = text = ""
-        if content.find("title") is not None:
-            title = content.find("title").text.strip()
-        if content.find("blockquote", {"class": "abstract mathjax"}) is not None:
-            text = content.find("blockquote", {"class": "abstract mathjax"}).text.strip()
+    def _extract_text_arxiv(content: HtmlElement) -> Tuple[str, str]:
+        title = TextExtractor._extract_title(content)
+        abstracts = _ARXIV_ABSTRACT(content)
+        text = _text(abstracts[0]) if abstracts else ""
         return title, text
 
     @staticmethod
-    def _extract_text_twitter(content: BeautifulSoup) -> Tuple[str, str]:
+    def _extract_text_twitter(content: HtmlElement) -> Tuple[str, str]:
         title = ""
         text = ""
-        if content.find("title") is not None:
-            text = content.find("title").text.strip()
+        titles = _TITLE(content)
+        if titles:
+            text = _text(titles[0])
             title = text[:50] + "..."
         return title, text
 
     @staticmethod
-    def _extract_text_bloomberg(content: BeautifulSoup) -> Tuple[str, str]:
+    def _extract_text_bloomberg(content: HtmlElement) -> Tuple[str, str]:
         # Bloomberg requires javascript enabled, i.e., in-memory rendering of pages. Skip for now.
         return "", ""
 
     @staticmethod
-    def _extract_text_instagram(content: BeautifulSoup) -> Tuple[str, str]:
+    def _extract_text_instagram(content: HtmlElement) -> Tuple[str, str]:
         title = text = ""
-        if content.find("script") is not None:
+        if _FIRST_SCRIPT(content):
             try:
-                data = json.loads(content.find('script', type='application/ld+json').text)
+                data = json.loads(_JSON_LD(content)[0].text)
                 text = data.get("caption", "")
                 title = data.get("name")
                 if title is not None:
@@ -85,7 +180,7 @@ class TextExtractor(object):
         return title, text
 
     @staticmethod
-    def _extract_text_quanta_magazine(content: BeautifulSoup) -> Tuple[str, str]:
+    def _extract_text_quanta_magazine(content: HtmlElement) -> Tuple[str, str]:
         # Example url with single content div:
         # https://www.quantamagazine.org/puzzle-with-infinite-regress-is-it-turtles-all-the-way-down-20200206/
 
@@ -94,59 +189,45 @@ class TextExtractor(object):
 
         # The Quantamagazine site is littered with <script ...> tags. Remove them to make it easier to extract
         # the textual contents.
-        script_tags = content.find_all("script")
-        _ = [s.extract() for s in script_tags]
-        title = content.select("#postBody > div:nth-of-type(1) > section > section > div > "
-                               "div.post__title.pv1.scale1.mha > div > h1")[0].get_text().strip()
-
-        text_containers = content.find_all("div", {"class": "post__content__section"})
-        text = "\n".join([t.get_text().strip() for t in text_containers])
+        etree.strip_elements(content, "script", with_tail=False)
+        titles = _QUANTA_TITLE(content)
+        title = _text(titles[0]) if titles else ""
+        text = "\n".join(_text(t) for t in _QUANTA_SECTIONS(content))
         return title, text
 
     @staticmethod
-    def _extract_text_medium(content: BeautifulSoup) -> Tuple[str, str]:
+    def _extract_text_medium(content: HtmlElement) -> Tuple[str, str]:
         # https://towardsdatascience.com/rl-train-the-robotic-arm-to-reach-a-ball-part-01-1cecd2e1cfb8?source=rss----7f60cf5620c9---4&gi=f8c99beafd9e
 
-        title = content.find("title").get_text().strip()
-        text_containers = content.select("#root > div > article > div > section > div > div")
+        title = TextExtractor._extract_title(content)
         tag_texts = []
-        for container in text_containers:
-            tags = container.find_all(["p", "h1", "h2", "h3", "h4", "h5", "h6"])
-            for tag in tags:
-                tag_texts.append(tag.get_text().strip())
+        for container in _MEDIUM_CONTAINERS(content):
+            for tag in _MEDIUM_TEXT_TAGS(container):
+                tag_texts.append(_text(tag))
         text = "\n".join(tag_texts)
         return title, text
 
     @staticmethod
     def extract_text(html, url) -> Tuple[str, str]:
         try:
-            title = text = ""
-            content = BeautifulSoup(html, "lxml")
-            if "twitter.com" in url:
-                title, text = TextExtractor._extract_text_twitter(content)
-            elif "arxiv.org" in url:
-                title, text = TextExtractor._extract_text_arxiv(content)
-            elif "bloomberg.com" in url:
-                title, text = TextExtractor._extract_text_bloomberg(content)
-            elif "instagram.com" in url:
-                title, text = TextExtractor._extract_text_instagram(content)
-            elif "quantamagazine.org" in url:
-                title, text = TextExtractor._extract_text_quanta_magazine(content)
-            elif "towardsdatascience.com" in url or "medium.com" in url:
-                title, text = TextExtractor._extract_text_medium(content)
-            else:
-                try:
-                    title, text = TextExtractor._extract_text_fancy(html, content)
-                except AttributeError as a_err:
-                    print("Could not extract title and text using Newspaper3k, resorting to basic tech")
-                    title, text = TextExtractor._extract_text_default(html)
-        except TypeError as t_err:
+            content = TextExtractor.parse(html)
+            title, text = TextExtractor.handler_for(url)(content)
+        except (TypeError, ValueError, etree.ParserError) as t_err:
             print("Could not parse payload, got error '{}' for payload '{}'".format(t_err, html))
             title = ""
             text = ""
         return title, text
 
 
+TextExtractor.register("twitter.com", TextExtractor._extract_text_twitter)
+TextExtractor.register("arxiv.org", TextExtractor._extract_text_arxiv)
+TextExtractor.register("bloomberg.com", TextExtractor._extract_text_bloomberg)
+TextExtractor.register("instagram.com", TextExtractor._extract_text_instagram)
+TextExtractor.register("quantamagazine.org", TextExtractor._extract_text_quanta_magazine)
+TextExtractor.register("towardsdatascience.com", TextExtractor._extract_text_medium)
+TextExtractor.register("medium.com", TextExtractor._extract_text_medium)
+
+
 if __name__ == "__main__":
     from src.main import HTTP_HEADERS
 
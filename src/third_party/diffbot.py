@@ -1,10 +1,17 @@
+import codecs
+import json
+import time
+
 import requests
 
+from src.retry import RetryPolicy, parse_retry_after
+
 # This file is taken from the official Diffbot client at: https://github.com/diffbot/diffbot-python-client
 
 class DiffbotClient(object):
 
     base_url = 'http://api.diffbot.com/'
+    retry_policy = RetryPolicy()
 
     def request(self, url, token, api, fields=None, version=3, **kwargs):
         """
@@ -14,10 +21,32 @@ class DiffbotClient(object):
         if fields:
             params['fields'] = fields
         params.update(kwargs)
-        response = requests.get(self.compose_url(api, version), params=params)
+        response = self.send_with_retries('GET', self.compose_url(api, version), params=params)
         response.raise_for_status()
         return response.json()
 
+    def send_with_retries(self, method, url, **kwargs):
+        """
+        Send the request, retrying connection errors, timeouts and responses such as 429 and 503 as given by
+        retry_policy. Returns the last response.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = requests.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                delay = self.retry_policy.delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                if not self.retry_policy.is_retryable(response.status_code):
+                    return response
+                delay = self.retry_policy.delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                if delay is None:
+                    return response
+            time.sleep(delay)
+            attempt += 1
+
     def compose_url(self, api, version_number):
         """
         Returns the uri for an endpoint as a string
@@ -38,11 +67,11 @@ class DiffbotJob(DiffbotClient):
     """
 
     def request(self,params):
-        response = requests.get(self.compose_url(self.jobType,3),params=params)
-        response.raise_for_status
+        response = self.send_with_retries('GET',self.compose_url(self.jobType,3),params=params)
+        response.raise_for_status()
         try:
             return response.json()
-        except:
+        except ValueError:
             print(response.text)
 
     def start(self,params):
@@ -60,32 +89,100 @@ class DiffbotJob(DiffbotClient):
         return response
 
     def delete(self):
-        temp_params = self.params
+        temp_params = dict(self.params)
         temp_params['delete'] = 1
         response = self.request(temp_params)
         return response
 
     def restart(self):
-        temp_params = self.params
+        temp_params = dict(self.params)
         temp_params['restart'] = 1
         response = self.request(temp_params)
         return response
 
+    def download_url(self,data_format="json"):
+        return '{}/download/{}-{}_data.{}'.format(
+            self.compose_url(self.jobType,3),self.params['token'],self.params['name'],data_format
+            )
+
     def download(self,data_format="json"):
         """
         downloads the JSON output of a crawl or bulk job
         """
 
-        download_url = '{}/v3/{}/download/{}-{}_data.{}'.format(
-            self.base_url,self.jobType,self.params['token'],self.params['name'],data_format
-            )
-        download = requests.get(download_url)
+        download = self.send_with_retries('GET',self.download_url(data_format))
         download.raise_for_status()
         if data_format == "csv":
             return download.content
         else:
             return download.json()
 
+    def iter_download(self,chunk_size=64 * 1024):
+        """
+        Yields the objects of the JSON output of a crawl or bulk job one at a time, as the output is downloaded,
+        so that the whole output is never held in memory.
+        """
+        with self.send_with_retries('GET',self.download_url(),stream=True) as download:
+            download.raise_for_status()
+            yield from iter_json_array(download.iter_content(chunk_size))
+
+
+def iter_json_array(chunks):
+    """
+    Yields the elements of a JSON array given as chunks of UTF-8 encoded bytes, decoding each element as soon as
+    it has been received in full.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    # The length of buffer needed before decoding is tried again. Grows with failed attempts, so that an element
+    # spanning many chunks is not decoded from the start once for every chunk.
+    needed = 0
+    started = False
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+            if len(buffer) < needed:
+                continue
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                # An element is only known to be complete once the , or ] after it has been received, since a
+                # number, e.g., 500 of 50089.5, may continue in the next chunk.
+                after = end
+                while after < len(buffer) and buffer[after] in ' \t\r\n':
+                    after += 1
+                complete = chunk is None or (after < len(buffer) and buffer[after] in ',]')
+            except ValueError:
+                if chunk is None:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                complete = False
+            if not complete:
+                buffer = buffer[position:]
+                position = 0
+                needed = 2 * len(buffer)
+                break
+            position = end
+            needed = 0
+            yield element
+
 class DiffbotCrawl(DiffbotJob):
     """
     Initializes a Diffbot crawl. Pass additional arguments as necessary.
@@ -103,4 +200,41 @@ class DiffbotCrawl(DiffbotJob):
             startParams['apiUrl'] = self.compose_url(api,apiVersion)
         startParams.update(kwargs)
         self.jobType = "crawl"
-        self.start(startParams)
\ No newline at end of file
+        self.start(startParams)
+
+
+class DiffbotBulk(DiffbotJob):
+    """
+    Initializes a Diffbot bulk job, which processes the given urls with the given api. Pass additional arguments
+    as necessary.
+    """
+
+    def __init__(self,token,name,urls=None,api='analyze',apiVersion=3,**kwargs):
+        self.params = {
+            "token": token,
+            "name": name,
+        }
+        self.jobType = "bulk"
+        if urls:
+            startParams = dict(self.params)
+            startParams['urls'] = ' '.join(urls)
+            startParams['apiUrl'] = self.compose_url(api,apiVersion)
+            startParams.update(kwargs)
+            self.start(startParams)
+
+    def start(self,params):
+        # The urls of a bulk job do not fit in a query string, so the job is started with a POST.
+        response = self.send_with_retries('POST',self.compose_url(self.jobType,3),data=params)
+        response.raise_for_status()
+        return response.json()
+
+    def job_status(self):
+        """
+        Returns the jobStatus of the job, e.g., {"status": 9, "message": "Job has completed and no repeat is
+        scheduled."}, or None if the job is not known.
+        """
+        response = self.status() or {}
+        for job in response.get('jobs', []):
+            if job.get('name') == self.params['name']:
+                return job.get('jobStatus')
+        return None
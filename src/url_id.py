@@ -0,0 +1,238 @@
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Union
+
+from w3lib.url import canonicalize_url, url_query_cleaner
+
+DIGEST_SIZE = 16
+
+
+@lru_cache(maxsize=1 << 16)
+def url_digest(url: str) -> bytes:
+    """
+    Returns the 16 byte MD5 digest of the canonicalized url. The digest, not its hex string, is what is kept in
+    memory. Results are memoized, since the same url tends to show up several times in one run.
+    """
+    normalized_url = canonicalize_url(url_query_cleaner(url, [], remove=False))
+    return hashlib.md5(normalized_url.encode('utf-8')).digest()
+
+
+def compute_id(url: str) -> str:
+    """ Returns the id of the url, as stored in the `_id` field of the MongoDb documents. """
+    return url_digest(url).hex()
+
+
+def id_to_digest(id: str) -> bytes:
+    return bytes.fromhex(id)
+
+
+def _run_contains(run: Union[bytes, mmap.mmap], digest: bytes) -> bool:
+    low, high = 0, len(run) // DIGEST_SIZE
+    while low < high:
+        middle = (low + high) // 2
+        offset = middle * DIGEST_SIZE
+        value = run[offset:offset + DIGEST_SIZE]
+        if value < digest:
+            low = middle + 1
+        elif value > digest:
+            high = middle
+        else:
+            return True
+    return False
+
+
+def _iter_run(run: Union[bytes, mmap.mmap]) -> Iterator[bytes]:
+    for offset in range(0, len(run), DIGEST_SIZE):
+        yield run[offset:offset + DIGEST_SIZE]
+
+
+def _merge_runs(first: Union[bytes, mmap.mmap], second: Union[bytes, mmap.mmap]) -> bytes:
+    merged = bytearray()
+    previous = None
+    for digest in heapq.merge(_iter_run(first), _iter_run(second)):
+        if digest != previous:
+            merged += digest
+            previous = digest
+    return bytes(merged)
+
+
+class SeenSet(object):
+    """
+    A compact set of url digests, using about 16 bytes per url. New digests are collected in a small Python set,
+    which is sorted into a packed run of digests once it holds `buffer_size` entries. Runs of similar size are
+    merged, so lookups binary search a logarithmic number of runs.
+
+    A SeenSet can be saved to disk and loaded back memory mapped, e.g., to let a restarted run skip all urls that
+    are known to be stored without querying MongoDb.
+    """
+
+    def __init__(self, buffer_size: int = 1 << 16):
+        self.buffer_size = buffer_size
+        self._runs: List[Union[bytes, mmap.mmap]] = []
+        self._buffer = set()
+        self._file = None
+
+    def __contains__(self, digest: bytes) -> bool:
+        if digest in self._buffer:
+            return True
+        return any(_run_contains(run, digest) for run in self._runs)
+
+    def __len__(self) -> int:
+        return len(self._compact()) // DIGEST_SIZE
+
+    def __iter__(self) -> Iterator[bytes]:
+        return _iter_run(self._compact())
+
+    def add(self, digest: bytes) -> None:
+        # Digests already in a run are not looked up again here; duplicates are dropped when runs are merged.
+        self._buffer.add(digest)
+        if len(self._buffer) >= self.buffer_size:
+            self._flush_buffer()
+
+    def update(self, digests: Iterable[bytes]) -> None:
+        for digest in digests:
+            self.add(digest)
+
+    def _flush_buffer(self) -> None:
+        if not self._buffer:
+            return
+        self._runs.append(b"".join(sorted(self._buffer)))
+        self._buffer = set()
+        while len(self._runs) > 1 and len(self._runs[-2]) <= 2 * len(self._runs[-1]):
+            second = self._runs.pop()
+            first = self._runs.pop()
+            self._runs.append(_merge_runs(first, second))
+
+    def _compact(self) -> Union[bytes, mmap.mmap]:
+        self._flush_buffer()
+        while len(self._runs) > 1:
+            second = self._runs.pop()
+            first = self._runs.pop()
+            self._runs.append(_merge_runs(first, second))
+        return self._runs[0] if self._runs else b""
+
+    def save(self, path: str) -> None:
+        """ Write the digests to `path` as one sorted run. The file is replaced atomically. """
+        run = self._compact()
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as output:
+            output.write(run)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str, buffer_size: int = 1 << 16) -> "SeenSet":
+        """ Open a file written by save(). The file is memory mapped rather than read into memory. """
+        seen = cls(buffer_size)
+        if os.path.getsize(path) > 0:
+            seen._file = open(path, "rb")
+            seen._runs.append(mmap.mmap(seen._file.fileno(), 0, access=mmap.ACCESS_READ))
+        return seen
+
+    def close(self) -> None:
+        for run in self._runs:
+            if isinstance(run, mmap.mmap):
+                run.close()
+        self._runs = [run for run in self._runs if not isinstance(run, mmap.mmap)]
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of url digests in a memory mapped file, sized for `capacity` urls at the given false positive
+    rate (about 1.2 bytes per url at 1%). A url not in the filter is certainly new; a url in the filter is known
+    with probability 1 - `error_rate`, so a run that trusts the filter skips that share of new urls.
+
+    The capacity and the number of urls added are kept in the header of the file. Beyond its capacity, the false
+    positive rate of the filter grows quickly, e.g., to above 80% at five times the capacity. A warning is printed
+    once the filter is full, and open_known_ids refuses to open a full filter.
+    """
+
+    MAGIC = b"URLBLOOM"
+    HEADER = struct.Struct("<8sQIQQd")
+
+    def __init__(self, path: str, capacity: int = 10000000, error_rate: float = 0.01):
+        self.path = path
+        if not os.path.exists(path):
+            num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+            num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+            with open(path, "wb") as output:
+                output.write(self.HEADER.pack(self.MAGIC, num_bits, num_hashes, capacity, 0, error_rate))
+                output.truncate(self.HEADER.size + (num_bits + 7) // 8)
+        self._file = open(path, "r+b")
+        self._bits = mmap.mmap(self._file.fileno(), 0)
+        magic, self.num_bits, self.num_hashes, self.capacity, self.count, self.error_rate = \
+            self.HEADER.unpack_from(self._bits, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Bloom filter of url ids")
+        self._warned = self.is_full
+
+    @property
+    def is_full(self) -> bool:
+        return self.count > self.capacity
+
+    def _positions(self, digest: bytes) -> Iterator[int]:
+        # The digest is already uniformly distributed; derive the hash functions from its two halves.
+        first, second = struct.unpack_from("<QQ", digest)
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self._bits
+        offset = self.HEADER.size
+        return all(bits[offset + (p >> 3)] & (1 << (p & 7)) for p in self._positions(digest))
+
+    def add(self, digest: bytes) -> None:
+        bits = self._bits
+        offset = self.HEADER.size
+        added = False
+        for p in self._positions(digest):
+            if not bits[offset + (p >> 3)] & (1 << (p & 7)):
+                bits[offset + (p >> 3)] |= 1 << (p & 7)
+                added = True
+        # Digests that were in the filter already, or seemed to be, are not counted.
+        if added:
+            self.count += 1
+            if self.count > self.capacity and not self._warned:
+                self._warned = True
+                print(f"Warning: the Bloom filter {self.path} holds more than its capacity of {self.capacity} urls, "
+                      f"so it skips more than {self.error_rate:.0%} of new urls. Recreate it with a larger capacity.")
+
+    def update(self, digests: Iterable[bytes]) -> None:
+        for digest in digests:
+            self.add(digest)
+
+    def save(self, path: Optional[str] = None) -> None:
+        """ The filter is updated in place; this flushes it to its own file. """
+        self.HEADER.pack_into(self._bits, 0, self.MAGIC, self.num_bits, self.num_hashes, self.capacity, self.count,
+                              self.error_rate)
+        self._bits.flush()
+
+    def close(self) -> None:
+        self._bits.close()
+        self._file.close()
+
+
+def open_known_ids(path: str, capacity: int = 10000000, error_rate: float = 0.01) -> Union[SeenSet, BloomFilter]:
+    """
+    Open the index of stored ids at `path`: a Bloom filter if the file name ends with .bloom, else a SeenSet. A new
+    Bloom filter is sized for `capacity` urls at `error_rate`. Raises ValueError if an existing filter is full.
+    """
+    if path.endswith(".bloom"):
+        bloom = BloomFilter(path, capacity, error_rate)
+        if bloom.is_full:
+            count, capacity = bloom.count, bloom.capacity
+            bloom.close()
+            raise ValueError(f"The Bloom filter {path} holds {count} urls, more than its capacity of {capacity}. "
+                             f"Delete it, and set a larger capacity, to build a new one from the next run.")
+        return bloom
+    if os.path.exists(path):
+        return SeenSet.load(path)
+    return SeenSet()
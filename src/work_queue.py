@@ -0,0 +1,150 @@
+import socket
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from src.ingest import new_urls
+from src.store import DUPLICATE_KEY_ERROR, DocumentStore, operation_id
+from src.url_id import SeenSet
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue(object):
+    """
+    A queue of urls in a MongoDb collection, shared by worker processes on one or more machines. Each url is a
+    document with the url id as `_id` and a `state`: pending, leased, done, or failed.
+
+    A worker leases a batch of pending urls at a time, and marks them done once their documents are written. A
+    lease runs out after `lease_timeout` seconds, after which the url is pending again and leased by another
+    worker, so urls of a crashed worker are not lost. Urls leased `max_attempts` times without being done are
+    marked failed. Give each worker a stable `worker_id`, e.g., the hostname and a number; a restarted worker
+    releases its own leases right away instead of waiting for them to run out.
+
+    Batches are leased in `_id` order from a random starting point, which spreads workers over the collection and
+    mixes the hosts of the urls, since ids are hashes.
+    """
+
+    def __init__(self, collection: Collection, worker_id: str, lease_timeout: float = 1800.0, max_attempts: int = 3):
+        self.collection = collection
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.checkpoints = collection.database[collection.name + "_checkpoints"]
+        collection.create_index([("state", ASCENDING), ("_id", ASCENDING)])
+        collection.create_index([("state", ASCENDING), ("leased_until", ASCENDING)])
+
+    def enqueue(self, items: Iterable[Tuple[str, str]]) -> None:
+        """ Add (id, url) pairs as pending. Urls already in the queue, in any state, are left as they are. """
+        documents = [{"_id": id, "url": url, "state": PENDING, "attempts": 0} for id, url in items]
+        if not documents:
+            return
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as error:
+            for write_error in error.details.get("writeErrors", []):
+                if write_error.get("code") != DUPLICATE_KEY_ERROR:
+                    raise
+
+    def enqueue_input(self, name: str, urls: Iterable[str], store: Optional[DocumentStore] = None,
+                      batch_size: int = 1000) -> int:
+        """
+        Add the urls of an input, e.g., a UrlSource, that are not yet stored, `batch_size` urls at a time. After
+        each batch, the number of urls read is saved as a checkpoint under `name`, so that an interrupted enqueue
+        resumes after the last checkpoint instead of looking up every url again. The checkpoint is deleted once the
+        input is read in full, so that a later input with the same name is read from the start. Returns the number
+        of urls read.
+        """
+        checkpoint = self.checkpoints.find_one({"_id": name}) or {}
+        position = checkpoint.get("urls_read", 0)
+        urls = iter(urls)
+        if position:
+            print("Resuming the enqueue of {} after {} urls".format(name, position))
+            for _ in islice(urls, position):
+                pass
+        seen = SeenSet()
+        while True:
+            batch = list(islice(urls, batch_size))
+            if not batch:
+                self.checkpoints.delete_one({"_id": name})
+                return position
+            self.enqueue(new_urls(batch, store, seen))
+            position += len(batch)
+            self.checkpoints.replace_one({"_id": name}, {"urls_read": position, "updated_at": datetime.utcnow()},
+                                         upsert=True)
+
+    def reclaim(self) -> None:
+        """ Make urls whose lease has run out pending again, or failed if they were leased too many times. """
+        now = datetime.utcnow()
+        expired = {"state": LEASED, "leased_until": {"$lt": now}}
+        self.collection.update_many(dict(expired, attempts={"$gte": self.max_attempts}),
+                                    {"$set": {"state": FAILED}, "$unset": {"worker": "", "lease": ""}})
+        self.collection.update_many(expired, {"$set": {"state": PENDING}, "$unset": {"worker": "", "lease": ""}})
+
+    def release(self) -> int:
+        """ Make the urls leased by this worker pending again, e.g., on a restart. Returns how many there were. """
+        result = self.collection.update_many({"state": LEASED, "worker": self.worker_id},
+                                             {"$set": {"state": PENDING}, "$unset": {"worker": "", "lease": ""}})
+        return result.modified_count
+
+    def lease(self, batch_size: int = 100) -> List[Tuple[str, str]]:
+        """ Lease up to `batch_size` pending urls. Returns their (id, url) pairs; an empty list if none are left. """
+        self.reclaim()
+        start = uuid.uuid4().hex
+        candidates = self._pending_ids({"$gte": start}, batch_size)
+        if len(candidates) < batch_size:
+            candidates += self._pending_ids({"$lt": start}, batch_size - len(candidates))
+        if not candidates:
+            return []
+        # Other workers may lease some of the same urls at the same time. The lease token tells which ones this
+        # worker got.
+        lease = uuid.uuid4().hex
+        self.collection.update_many(
+            {"_id": {"$in": candidates}, "state": PENDING},
+            {"$set": {"state": LEASED, "worker": self.worker_id, "lease": lease,
+                      "leased_until": datetime.utcnow() + timedelta(seconds=self.lease_timeout)},
+             "$inc": {"attempts": 1}})
+        # By _id, so that the query uses the _id index instead of scanning the queue for the lease token.
+        leased = self.collection.find({"_id": {"$in": candidates}, "lease": lease}, {"_id": 1, "url": 1})
+        return [(d["_id"], d["url"]) for d in leased]
+
+    def _pending_ids(self, id_range: Dict[str, str], limit: int) -> List[str]:
+        query = {"state": PENDING, "_id": id_range}
+        return [d["_id"] for d in self.collection.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(limit)]
+
+    def leased_urls(self, batch_size: int = 100) -> Iterator[Tuple[str, str]]:
+        """ Yields (id, url) pairs, leasing a new batch whenever the previous one is used up, until none are left. """
+        while True:
+            batch = self.lease(batch_size)
+            if not batch:
+                return
+            yield from batch
+
+    def complete(self, ids: Iterable[str]) -> None:
+        self.collection.update_many({"_id": {"$in": list(ids)}},
+                                    {"$set": {"state": DONE}, "$unset": {"worker": "", "lease": "",
+                                                                         "leased_until": ""}})
+
+    def on_written(self, operations: List[object]) -> None:
+        """ Marks the urls of written documents done. Pass as `on_written` to the DocumentStore of the worker. """
+        ids = [id for id in map(operation_id, operations) if id is not None]
+        if ids:
+            self.complete(ids)
+
+    def counts(self) -> Dict[str, int]:
+        """ Returns the number of urls per state. """
+        pipeline = [{"$group": {"_id": "$state", "count": {"$sum": 1}}}]
+        return {d["_id"]: d["count"] for d in self.collection.aggregate(pipeline)}
+
+
+def default_worker_id() -> str:
+    """ A worker id that stays the same when the worker restarts on the same machine. """
+    return socket.gethostname()